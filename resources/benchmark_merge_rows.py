@@ -0,0 +1,120 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+from consolidate_links import INPUT_FIELDS, OUTPUT_FIELDS, LinkRecord, merge_rows, vectorized_merge_rows
+
+
+METHODS = ["czi_affiliation_links", "joss_affiliation_links", "by_name", "human_curated", "ner_text_extraction",
+           "url_matches", "openaire_czi"]
+# Number of ROR ids each software is linked to
+RORS_PER_SOFTWARE = 2
+# Maximum number of distinct software, so that the 50M row benchmark fits in 5GB of memory
+MAX_SOFTWARE = 1_000_000
+
+
+def generate_datasets(num_rows: int, num_sources: int = 6, seed: int = 0) -> list:
+    """
+    Generate synthetic data in the format shown in `consolidate_links.reformat_orca_url_matches`, as numpy arrays of
+    codes into arrays of distinct values, so that even 50M rows fit in memory. Each software is linked to
+    `RORS_PER_SOFTWARE` ROR ids over ~20 rows (more above `MAX_SOFTWARE` * 20 rows), so there is one software-ROR
+    pair per ~10 rows, and names vary in case and surrounding whitespace as they do in the real sources
+    :param num_rows: Total number of rows to generate
+    :param num_sources: Number of data sources to split the rows over
+    :param seed: Random seed, so the same data can be generated for each merge engine
+    :return: Tuple of (dict mapping each field in `INPUT_FIELDS` to an object array of its distinct values, list of
+             dicts mapping each field to an array of codes into its distinct values, one per data source)
+    """
+    rand = np.random.default_rng(seed)
+    num_software = min(max(num_rows // 20, 1), MAX_SOFTWARE)
+    num_rors = max(num_rows // 500, 1)
+    software = np.arange(num_software)
+    values = {
+        # Every name also comes upper-cased and padded, at code + num_software
+        "software_name": np.array([f"software-{i}" for i in software] + [f" SOFTWARE-{i} " for i in software],
+                                  dtype=object),
+        "github_slug": np.array([f"owner-{i % 1000}/software-{i}" for i in software], dtype=object),
+        "ror_id": np.array([f"https://ror.org/{i:09d}" for i in range(num_rors)], dtype=object),
+        "extraction_method": np.array(METHODS, dtype=object)
+    }
+    sources = []
+    for i in range(num_sources):
+        source_rows = num_rows // num_sources + (i < num_rows % num_sources)
+        software_idx = rand.integers(num_software, size=source_rows, dtype=np.int32)
+        sources.append({
+            "software_name": software_idx + num_software * (rand.random(source_rows) < 0.1).astype(np.int32),
+            "github_slug": software_idx,
+            "ror_id": ((software_idx.astype(np.int64) * 7 + rand.integers(RORS_PER_SOFTWARE, size=source_rows))
+                       % num_rors).astype(np.int32),
+            "extraction_method": rand.integers(len(METHODS), size=source_rows, dtype=np.int8)
+        })
+    return values, sources
+
+
+def generate_rows(values: dict, source_codes: dict) -> iter:
+    """
+    Generate the records of a synthetic data source one by one, as the reformat functions do for `merge_rows`
+    :param values: Dict mapping each field to an object array of its distinct values
+    :param source_codes: Dict mapping each field to an array of codes into its distinct values
+    :return: Generator of records
+    """
+    columns = [values[field][source_codes[field]].tolist() for field in INPUT_FIELDS]
+    for software_name, github_slug, ror_id, extraction_method in zip(*columns):
+        yield {
+            "software_name": software_name,
+            "github_slug": github_slug,
+            "ror_id": ror_id,
+            "extraction_method": extraction_method
+        }
+
+
+def make_frame(dtypes: dict, source_codes: dict) -> pd.DataFrame:
+    """
+    Build the DataFrame of a synthetic data source, as the functions in `consolidate_links.FRAME_REFORMATTERS` do
+    for `vectorized_merge_rows`. Columns are categorical, so their values are not copied for each row
+    :param dtypes: Dict mapping each field to a categorical dtype over its distinct values
+    :param source_codes: Dict mapping each field to an array of codes into its distinct values
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    return pd.DataFrame({field: pd.Categorical.from_codes(source_codes[field], dtype=dtypes[field], validate=False)
+                         for field in INPUT_FIELDS})
+
+
+def benchmark(num_rows: int, check: bool) -> None:
+    """
+    Time `merge_rows` and `vectorized_merge_rows` over the same synthetic data, and print the speedup. Each engine
+    is timed from its own input format, per-row dicts for `merge_rows` and per-source DataFrames for
+    `vectorized_merge_rows`, up to its merged output. Writing the output is not included in the timings
+    :param num_rows: Number of input rows
+    :param check: If true, also check that both engines return the same records
+    :return: None
+    """
+    values, sources = generate_datasets(num_rows)
+    start = time.perf_counter()
+    merged = merge_rows([generate_rows(values, source_codes) for source_codes in sources])
+    python_time = time.perf_counter() - start
+    expected = [[row[field] for field in OUTPUT_FIELDS] for row in map(LinkRecord.to_row, merged)] if check else None
+    num_merged = len(merged)
+    del merged
+
+    dtypes = {field: pd.CategoricalDtype(pd.Index(values[field], dtype=object)) for field in INPUT_FIELDS}
+    start = time.perf_counter()
+    merged = vectorized_merge_rows([make_frame(dtypes, source_codes) for source_codes in sources])
+    vectorized_time = time.perf_counter() - start
+    print(f"{num_rows} rows, {num_merged} merged: python {python_time:.2f}s, vectorized {vectorized_time:.2f}s, "
+          f"speedup {python_time / vectorized_time:.2f}x")
+    if check:
+        actual = merged[OUTPUT_FIELDS].values.tolist()
+        assert expected == actual, f"Merge engines disagree on {num_rows} rows"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000, 50_000_000],
+                        help="Numbers of input rows to benchmark")
+    parser.add_argument("--check", action="store_true", help="Check that both merge engines return the same records")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        benchmark(size, args.check)
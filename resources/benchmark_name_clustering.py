@@ -0,0 +1,43 @@
+import argparse
+import csv
+import os
+import time
+
+from consolidate_links import LinkRecord, cluster_near_duplicate_names
+
+
+def read_links(links_csv: str) -> list:
+    """
+    Read the csv output of `consolidate_links.py` back into records
+    :param links_csv: Path to consolidated links csv
+    :return: List of `LinkRecord`s, in the order they were written
+    """
+    with open(links_csv) as f:
+        return [LinkRecord(row["software_name"], row["github_slug"], row["ror_id"],
+                           row["extraction_methods"].split(";")) for row in csv.DictReader(f)]
+
+
+def benchmark(links_csv: str, threshold: float) -> None:
+    """
+    Time `cluster_near_duplicate_names` over the consolidated links, and print how many records were merged
+    :param links_csv: Path to consolidated links csv
+    :param threshold: Minimum Jaccard similarity of two names' trigrams for them to be clustered
+    :return: None
+    """
+    records = read_links(links_csv)
+    start = time.perf_counter()
+    merged, clusters = cluster_near_duplicate_names(records, threshold)
+    elapsed = time.perf_counter() - start
+    print(f"{len(records)} records: clustered in {elapsed:.2f}s, merging {len(clusters)} names into "
+          f"{len({(ror_id, name) for ror_id, name, _ in clusters})} others, leaving {len(merged)} records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links_csv", default=os.path.join("..", "software_to_ror.csv"))
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.7],
+                        help="Similarity thresholds to benchmark")
+    args = parser.parse_args()
+
+    for threshold in args.thresholds:
+        benchmark(args.links_csv, threshold)
@@ -1,90 +1,302 @@
 import argparse
 import csv
+import hashlib
+import heapq
+import importlib.util
 import json
 import os
+import re
+import sqlite3
+import tempfile
+import zlib
+import numpy as np
 import pandas as pd
 
+from collections import Counter
+from itertools import combinations, groupby
+from multiprocessing.pool import Pool
 
-def reformat_orca_url_matches(url_matches: str, full_data: str) -> list:
+try:
+    # orjson parses JSON several times faster than the standard library, so we use it for the ORCA download if it
+    # is installed
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+
+# Not casting aspersions, just noting that some methods return less ambiguous matches than others!
+HIGH_QUALITY_METHODS = ["czi_affiliation_links", "joss_affiliation_links", "by_name", "human_curated"]
+MEDIUM_QUALITY_METHODS = ["ner_text_extraction", "url_matches"]
+# Registry of extraction methods. Each method's code is its position in `METHODS`. Methods we haven't seen before
+# are registered by `method_code`
+METHODS = HIGH_QUALITY_METHODS + MEDIUM_QUALITY_METHODS + ["openaire_czi"]
+METHOD_CODES = {method: code for code, method in enumerate(METHODS)}
+HIGH_QUALITY_MASK = sum(1 << METHOD_CODES[method] for method in HIGH_QUALITY_METHODS)
+MEDIUM_QUALITY_MASK = sum(1 << METHOD_CODES[method] for method in MEDIUM_QUALITY_METHODS)
+# Fields of the records every source is reformatted into
+INPUT_FIELDS = ["software_name", "github_slug", "ror_id", "extraction_method"]
+OUTPUT_FIELDS = ["software_name", "github_slug", "ror_id", "extraction_methods", "quality"]
+# Number of rows held in memory at a time before a sorted run is spilled to disk in streaming mode
+DEFAULT_RUN_SIZE = 1_000_000
+# Number of rows in each row group of the Parquet output
+DEFAULT_ROW_GROUP_SIZE = 100_000
+# If pyarrow is installed, pandas can use it to parse large csvs with multiple threads
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+# MinHash LSH settings for near-duplicate software name clustering. With 8 bands of 4 rows, two names whose
+# character trigrams have a Jaccard similarity of 0.7 share at least one band with probability ~0.89
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_PRIME = (1 << 31) - 1
+NAME_SIMILARITY_THRESHOLD = 0.7
+# Names shorter than this once normalized have few trigrams, so different short names can share most of them, e.g.
+# "spade" and "spades" have a similarity of 0.75, "bcftools" and "vcftools" of 0.71. They must be more similar to be
+# clustered
+SHORT_NAME_LENGTH = 10
+SHORT_NAME_SIMILARITY_THRESHOLD = 0.9
+# Members of LSH buckets up to this size are all compared with each other. Larger buckets only compare neighbours, so
+# that a bucket of many near-identical names does not take quadratic time
+MAX_BUCKET_SIZE = 50
+# Version of the merged-state store schema. Stores written with a different version are rebuilt from scratch
+STATE_VERSION = 3
+# Schema of the merged-state store used for incremental consolidation. `source_rows` holds every reformatted row
+# with the source it came from, `merged` holds one record per software-ROR pair, and `sources` holds the
+# fingerprint of the input files each source was last read from, and their sizes and modification times
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, idx INTEGER, fingerprint TEXT, stats TEXT);
+CREATE TABLE IF NOT EXISTS source_rows (source TEXT, source_idx INTEGER, seq INTEGER, id TEXT, method TEXT,
+                                        record TEXT);
+CREATE INDEX IF NOT EXISTS source_rows_source ON source_rows (source);
+CREATE INDEX IF NOT EXISTS source_rows_id ON source_rows (id, source_idx, seq);
+CREATE TABLE IF NOT EXISTS merged (id TEXT PRIMARY KEY, record TEXT);
+"""
+
+
+def generate_orca_owner_repos(full_data: str, owners: set) -> iter:
     """
-    Reformat url matches over the ORCA data into the standard format
-    :param url_matches: Name of file containing owner <-> ROR matches found from URL match over ORCA data
+    Stream the ORCA data download, keeping only repos whose owners are in `owners`
     :param full_data: Full ORCA data download
-    :return: List of reformatted records
+    :param owners: Owners whose repos should be kept
+    :return: Generator of (owner, repo name) tuples, in the order they appear in the download
     """
-    org_to_repos = {}
-    reformatted = []
-    with open(full_data) as f:
+    with open(full_data, mode="rb") as f:
         for line in f:
-            js = json.loads(line)
+            js = json_loads(line)
             owner = js["owner_name"]
-            repo = js["current_name"]
-            if owner not in org_to_repos:
-                org_to_repos[owner] = []
-            org_to_repos[owner].append(repo)
+            if owner in owners:
+                yield owner, js["current_name"]
+
+
+def build_orca_index(full_data: str, orca_index: str) -> None:
+    """
+    Build an index mapping every owner in the ORCA data download to its repos, so later runs can read the repos of
+    just the owners they need without parsing the download again
+    :param full_data: Full ORCA data download
+    :param orca_index: Path where the index, a SQLite database, should be written. Replaced if it already exists
+    :return: None
+    """
+    if os.path.exists(orca_index):
+        os.remove(orca_index)
+    conn = sqlite3.connect(orca_index)
+    conn.executescript("""
+    CREATE TABLE meta (size INTEGER, mtime_ns INTEGER);
+    CREATE TABLE owners (owner TEXT PRIMARY KEY, seq INTEGER);
+    CREATE TABLE repos (owner TEXT, repo TEXT, seq INTEGER, PRIMARY KEY (owner, repo));
+    """)
+    with conn, open(full_data, mode="rb") as f:
+        for seq, line in enumerate(f):
+            js = json_loads(line)
+            # Ignoring duplicates keeps the position each owner and repo was first seen at
+            conn.execute("INSERT OR IGNORE INTO owners VALUES (?, ?)", (js["owner_name"], seq))
+            conn.execute("INSERT OR IGNORE INTO repos VALUES (?, ?, ?)", (js["owner_name"], js["current_name"], seq))
+        stat = os.stat(full_data)
+        conn.execute("INSERT INTO meta VALUES (?, ?)", (stat.st_size, stat.st_mtime_ns))
+    conn.close()
+
+
+def read_orca_index(full_data: str, orca_index: str, owners: set) -> iter:
+    """
+    Read the repos of `owners` from an index built by `build_orca_index`, (re)building the index first if it is
+    missing or older than the ORCA data download
+    :param full_data: Full ORCA data download
+    :param orca_index: Path to index
+    :param owners: Owners whose repos should be read
+    :return: Generator of (owner, repo name) tuples, in the order they first appear in the download
+    """
+    stat = os.stat(full_data)
+    conn = sqlite3.connect(orca_index) if os.path.exists(orca_index) else None
+    if conn is None or conn.execute("SELECT size, mtime_ns FROM meta").fetchone() != (stat.st_size,
+                                                                                       stat.st_mtime_ns):
+        if conn is not None:
+            conn.close()
+        print(f"Building ORCA owner index {orca_index}")
+        build_orca_index(full_data, orca_index)
+        conn = sqlite3.connect(orca_index)
+    try:
+        conn.execute("CREATE TEMP TABLE wanted (owner TEXT PRIMARY KEY)")
+        conn.executemany("INSERT INTO wanted VALUES (?)", ((owner,) for owner in owners))
+        yield from conn.execute("SELECT repos.owner, repos.repo FROM repos "
+                                "JOIN wanted ON repos.owner = wanted.owner "
+                                "JOIN owners ON repos.owner = owners.owner "
+                                "ORDER BY owners.seq, repos.seq")
+    finally:
+        conn.close()
+
+
+def read_orca_owner_repos(url_matches: str, full_data: str, orca_index: str = None) -> tuple:
+    """
+    Read the owner <-> ROR matches found from URL match over ORCA data, and the repos of the matched owners
+    :param url_matches: Name of file containing owner <-> ROR matches found from URL match over ORCA data
+    :param full_data: Full ORCA data download
+    :param orca_index: If set, path to an index of the ORCA data download built by `build_orca_index`, which is
+           read instead of the download. Built if it does not exist yet
+    :return: Tuple of (dict mapping owners to their ROR ids, dict mapping owners to ordered sets of their repos).
+             Owners and repos are in the order they were first seen
+    """
+    # Only owners with a ROR match are ever output, so we read the (small) match file first, then keep only those
+    # owners' repos as we read the (large) ORCA data
     with open(url_matches) as f:
         org_to_ror = json.loads(f.read())
+    if orca_index:
+        owner_repos = read_orca_index(full_data, orca_index, set(org_to_ror))
+    else:
+        owner_repos = generate_orca_owner_repos(full_data, set(org_to_ror))
+    # The dict of repos serves as an ordered set
+    org_to_repos = {}
+    for owner, repo in owner_repos:
+        if owner not in org_to_repos:
+            org_to_repos[owner] = {}
+        org_to_repos[owner][repo] = None
+    return org_to_ror, org_to_repos
+
+
+def reformat_orca_url_matches(url_matches: str, full_data: str, orca_index: str = None) -> iter:
+    """
+    Reformat url matches over the ORCA data into the standard format
+    :param url_matches: Name of file containing owner <-> ROR matches found from URL match over ORCA data
+    :param full_data: Full ORCA data download
+    :param orca_index: If set, path to an index of the ORCA data download built by `build_orca_index`, which is
+           read instead of the download. Built if it does not exist yet
+    :return: Generator of reformatted records
+    """
+    org_to_ror, org_to_repos = read_orca_owner_repos(url_matches, full_data, orca_index)
     for owner in org_to_repos:
-        unique_repos = set(org_to_repos[owner])
-        for repo in unique_repos:
+        for repo in org_to_repos[owner]:
             name = f"{owner}/{repo}"
-            for ror_id in org_to_ror.get(owner, []):
-                reformatted.append({
+            for ror_id in org_to_ror[owner]:
+                yield {
                     "software_name": name,
                     "github_slug": name,
                     "ror_id": ror_id,
                     "extraction_method": "url_matches"
-                })
-    return reformatted
+                }
 
 
-def reformat_stack_readme_matches(stack_matches: str) -> list:
+def reformat_orca_url_matches_frame(url_matches: str, full_data: str, orca_index: str = None) -> pd.DataFrame:
+    """
+    Reformat url matches over the ORCA data into a DataFrame of records in the standard format, for
+    `vectorized_merge_rows`
+    :param url_matches: Name of file containing owner <-> ROR matches found from URL match over ORCA data
+    :param full_data: Full ORCA data download
+    :param orca_index: If set, path to an index of the ORCA data download built by `build_orca_index`, which is
+           read instead of the download. Built if it does not exist yet
+    :return: DataFrame with the columns in `INPUT_FIELDS`, with rows in the order `reformat_orca_url_matches`
+             yields them
+    """
+    org_to_ror, org_to_repos = read_orca_owner_repos(url_matches, full_data, orca_index)
+    names = [f"{owner}/{repo}" for owner in org_to_repos for repo in org_to_repos[owner]]
+    ror_ids = [org_to_ror[owner] for owner in org_to_repos for _ in org_to_repos[owner]]
+    num_rors = np.array([len(rors) for rors in ror_ids], dtype=np.int64)
+    names = np.repeat(np.array(names, dtype=object), num_rors)
+    return pd.DataFrame({
+        "software_name": names,
+        "github_slug": names,
+        "ror_id": np.array([ror_id for rors in ror_ids for ror_id in rors], dtype=object),
+        "extraction_method": "url_matches"
+    }, columns=INPUT_FIELDS)
+
+
+def reformat_stack_readme_matches(stack_matches: str, use_arrow: bool = False) -> iter:
     """
     Reformat NER matches over the Stack README data into the standard format
     :param url_matches: Name of file containing software-ROR affiliations extracted from The Stack
-    :return: List of reformatted records
+    :param use_arrow: If true, parse the whole file at once with pyarrow's multi-threaded csv reader
+    :return: Generator of reformatted records
     """
-    reformatted = []
+    if use_arrow:
+        df = reformat_stack_readme_matches_frame(stack_matches, use_arrow)
+        for repo_name, ror_id in zip(df["software_name"], df["ror_id"]):
+            yield {
+                "software_name": repo_name,
+                "github_slug": repo_name,
+                "ror_id": ror_id,
+                "extraction_method": "ner_text_extraction"
+            }
+        return
     with open(stack_matches) as f:
         reader = csv.DictReader(f)
         for line in reader:
             ror_id = line["ror_id"]
             if ror_id:
-                reformatted.append({
+                yield {
                     "software_name": line["repo_name"],
                     "github_slug": line["repo_name"],
                     "ror_id": ror_id,
                     "extraction_method": "ner_text_extraction"
-                })
-    return reformatted
+                }
 
 
-def reformat_working_curated(working_curated: str) -> list:
+def reformat_stack_readme_matches_frame(stack_matches: str, use_arrow: bool = False) -> pd.DataFrame:
+    """
+    Reformat NER matches over the Stack README data into a DataFrame of records in the standard format
+    :param stack_matches: Name of file containing software-ROR affiliations extracted from The Stack
+    :param use_arrow: If true, parse the file with pyarrow's multi-threaded csv reader
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    df = pd.read_csv(stack_matches, engine="pyarrow" if use_arrow else None, dtype=str, keep_default_na=False,
+                     usecols=["repo_name", "ror_id"])
+    df = df[df["ror_id"] != ""]
+    return pd.DataFrame({
+        "software_name": df["repo_name"],
+        "github_slug": df["repo_name"],
+        "ror_id": df["ror_id"],
+        "extraction_method": "ner_text_extraction"
+    }, columns=INPUT_FIELDS).reset_index(drop=True)
+
+
+def reformat_working_curated(working_curated: str) -> iter:
     """
     Reformat working curated data into the standard format
     :param working_curated: Name of file containing minimal working curated data
-    :return: List of reformatted records
+    :return: Generator of reformatted records
     """
-    reformatted = []
     with open(working_curated) as f:
         reader = csv.DictReader(f)
         for row in reader:
-            reformatted.append({
+            yield {
                 "software_name": row["software_name"],
                 "github_slug": row["github_slug"],
                 "ror_id": row["ror_id"],
                 "extraction_method": row["extraction_methods"]
-            })
-    return reformatted
+            }
 
 
-def reformat_czi_affiliation_rors(software_to_rors: str) -> list:
+def reformat_working_curated_frame(working_curated: str) -> pd.DataFrame:
+    """
+    Reformat working curated data into a DataFrame of records in the standard format
+    :param working_curated: Name of file containing minimal working curated data
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    df = pd.read_csv(working_curated, dtype=str, keep_default_na=False,
+                     usecols=["software_name", "github_slug", "ror_id", "extraction_methods"])
+    return df.rename(columns={"extraction_methods": "extraction_method"})[INPUT_FIELDS]
+
+
+def reformat_czi_affiliation_rors(software_to_rors: str) -> iter:
     """
     Reformat csvs mapping affiliation software to ror ids into the standard format
     :param software_to_rors: Name of file containing software to author affiliation rors
-    :return: List of reformatted records
+    :return: Generator of reformatted records
     """
-    reformatted = []
     with open(software_to_rors) as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -93,89 +305,904 @@ def reformat_czi_affiliation_rors(software_to_rors: str) -> list:
             repo = "/".join(repo.split("/")[-2:])
             if not ror or ror == "NA":
                 continue
-            reformatted.append({
+            yield {
                 "software_name": row["mention"],
                 "github_slug": repo,
                 "ror_id": ror,
                 "extraction_method": "czi_affiliation_links"
-            })
-        return reformatted
+            }
 
 
-def reformat_joss_affiliation_rors(software_to_rors: str) -> list:
+def reformat_czi_affiliation_rors_frame(software_to_rors: str) -> pd.DataFrame:
+    """
+    Reformat csvs mapping affiliation software to ror ids into a DataFrame of records in the standard format
+    :param software_to_rors: Name of file containing software to author affiliation rors
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    df = pd.read_csv(software_to_rors, dtype=str, keep_default_na=False, usecols=["mention", "github_slug", "ROR_ID"])
+    df = df[(df["ROR_ID"] != "") & (df["ROR_ID"] != "NA")]
+    return pd.DataFrame({
+        "software_name": df["mention"],
+        "github_slug": df["github_slug"].str.split("/").str[-2:].str.join("/"),
+        "ror_id": df["ROR_ID"],
+        "extraction_method": "czi_affiliation_links"
+    }, columns=INPUT_FIELDS).reset_index(drop=True)
+
+
+def reformat_joss_affiliation_rors(software_to_rors: str) -> iter:
     """
     Reformat jsonl mapping affiliation software to ror ids into the standard format
     :param software_to_rors: Name of file containing software to author affiliation rors
-    :return: List of reformatted records
+    :return: Generator of reformatted records
     """
-    reformatted = []
     with open(software_to_rors) as f:
         for line in f:
             row = json.loads(line)
             ror = row["ror_id"]
             repo = row["github_slug"]
-            reformatted.append({
+            yield {
                 "software_name": row["software_name"],
                 "github_slug": repo,
                 "ror_id": ror,
                 "extraction_method": "joss_affiliation_links"
-            })
-        return reformatted
+            }
+
+
+def reformat_joss_affiliation_rors_frame(software_to_rors: str) -> pd.DataFrame:
+    """
+    Reformat jsonl mapping affiliation software to ror ids into a DataFrame of records in the standard format
+    :param software_to_rors: Name of file containing software to author affiliation rors
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    with open(software_to_rors) as f:
+        rows = [json.loads(line) for line in f]
+    return pd.DataFrame({
+        "software_name": [row["software_name"] for row in rows],
+        "github_slug": [row["github_slug"] for row in rows],
+        "ror_id": [row["ror_id"] for row in rows],
+        "extraction_method": "joss_affiliation_links"
+    }, columns=INPUT_FIELDS, dtype=object)
+
+
+def read_openaire_czi_matches(openaire_czi_matches_file: str, chunksize: int = None, use_arrow: bool = False) -> iter:
+    """
+    Read csv.gz from OpenAIRE and CZI mentions merged data into DataFrames of records in the standard format
+    :param openaire_czi_matches_file: Name of file containing software to ror id relations
+    :param chunksize: If set, read the file in chunks of this many rows rather than all at once. Duplicates are then
+           only dropped within a chunk, which is fine as `merge_rows` collapses identical records anyway
+    :param use_arrow: If true and `chunksize` is not set, parse the file with pyarrow's multi-threaded csv reader
+    :return: Generator of DataFrames
+    """
+    if chunksize:
+        chunks = pd.read_csv(openaire_czi_matches_file, compression='gzip', delimiter='\t', encoding='utf-8',
+                             chunksize=chunksize)
+    else:
+        chunks = [pd.read_csv(openaire_czi_matches_file, compression='gzip', delimiter='\t', encoding='utf-8',
+                              engine="pyarrow" if use_arrow else None)]
+    for df in chunks:
+        df = df.rename(columns={'github_repo': 'github_slug', 'software': 'software_name', 'RORid': 'ror_id'})
+        df = df.drop_duplicates()
+        df['extraction_method'] = 'openaire_czi'
+        yield df
 
 
-def reformat_openaire_czi_matches(openaire_czi_matches_file: str):
+def reformat_openaire_czi_matches(openaire_czi_matches_file: str, chunksize: int = None,
+                                  use_arrow: bool = False) -> iter:
     """
     Reformat csv.gz from OpenAIRE and CZI mentions merged data
     :param openaire_czi_matches_file: Name of file containing software to ror id relations
-    :return: List of reformatted records
+    :param chunksize: See `read_openaire_czi_matches`
+    :param use_arrow: See `read_openaire_czi_matches`
+    :return: Generator of reformatted records
+    """
+    for df in read_openaire_czi_matches(openaire_czi_matches_file, chunksize, use_arrow):
+        yield from df.to_dict(orient='records')
+
+
+def reformat_openaire_czi_matches_frame(openaire_czi_matches_file: str, chunksize: int = None,
+                                        use_arrow: bool = False) -> pd.DataFrame:
+    """
+    Reformat csv.gz from OpenAIRE and CZI mentions merged data into a DataFrame of records in the standard format
+    :param openaire_czi_matches_file: Name of file containing software to ror id relations
+    :param chunksize: Ignored, as the whole file is read at once
+    :param use_arrow: See `read_openaire_czi_matches`
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    df, = read_openaire_czi_matches(openaire_czi_matches_file, use_arrow=use_arrow)
+    return df[INPUT_FIELDS].reset_index(drop=True)
+
+
+# Functions reading each source into a single DataFrame of records rather than a generator of records, for
+# `vectorized_merge_rows`. Each takes the same arguments as the generator it is keyed by
+FRAME_REFORMATTERS = {
+    reformat_orca_url_matches: reformat_orca_url_matches_frame,
+    reformat_stack_readme_matches: reformat_stack_readme_matches_frame,
+    reformat_working_curated: reformat_working_curated_frame,
+    reformat_czi_affiliation_rors: reformat_czi_affiliation_rors_frame,
+    reformat_joss_affiliation_rors: reformat_joss_affiliation_rors_frame,
+    reformat_openaire_czi_matches: reformat_openaire_czi_matches_frame,
+}
+
+
+def method_code(method: str) -> int:
     """
-    df = pd.read_csv(openaire_czi_matches_file, compression='gzip', delimiter='\t', encoding='utf-8')
-    df = df.rename(columns={'github_repo': 'github_slug', 'software': 'software_name', 'RORid': 'ror_id'})
-    df = df.drop_duplicates()
-    df['extraction_method'] = 'openaire_czi'
+    Get the code of an extraction method, registering the method if we haven't seen it before
+    :param method: Extraction method
+    :return: Code of the method
+    """
+    code = METHOD_CODES.get(method)
+    if code is None:
+        code = len(METHODS)
+        # `LinkRecord` packs method codes, plus one, into a byte each
+        if code >= 255:
+            raise ValueError(f"Too many distinct extraction methods to register {method}")
+        METHODS.append(method)
+        METHOD_CODES[method] = code
+    return code
+
 
-    return df.to_dict(orient='records')
+class LinkRecord:
+    """
+    A merged software-ROR pair. Rather than a list of strings, extraction methods are held as two integers:
+    `methods` is a bitmask over method codes, used for membership and quality tests, and `method_order` packs the
+    method codes, plus one, into a byte each in the order the methods were first seen. Method names are only
+    decoded when the record is written out
+    """
+    __slots__ = ["software_name", "github_slug", "ror_id", "methods", "method_order"]
+
+    def __init__(self, software_name: str, github_slug: str, ror_id: str, extraction_methods: list = ()):
+        self.software_name = software_name
+        self.github_slug = github_slug
+        self.ror_id = ror_id
+        self.methods = 0
+        self.method_order = 0
+        for method in extraction_methods:
+            self.add_method(method)
+
+    def add_method(self, method: str) -> None:
+        """
+        Add an extraction method to the record, if it isn't there already
+        :param method: Extraction method
+        :return: None
+        """
+        code = method_code(method)
+        if not self.methods & (1 << code):
+            self.method_order |= (code + 1) << (8 * self.methods.bit_count())
+            self.methods |= 1 << code
+
+    @property
+    def extraction_methods(self) -> list:
+        """
+        :return: List of extraction methods, in the order they were first seen
+        """
+        order = self.method_order
+        methods = []
+        while order:
+            methods.append(METHODS[(order & 0xff) - 1])
+            order >>= 8
+        return methods
+
+    @property
+    def quality(self) -> float:
+        """
+        :return: 1 if high-quality, 0.5 if medium-quality, 0 if low-quality
+        """
+        num_methods = self.methods.bit_count()
+        if num_methods > 1 or self.methods & HIGH_QUALITY_MASK:
+            return 1
+        return 0.5 if num_methods == 1 and self.methods & MEDIUM_QUALITY_MASK else 0
+
+    def to_row(self) -> dict:
+        """
+        :return: The record in the format written to the output csv
+        """
+        return {
+            "software_name": self.software_name,
+            "github_slug": self.github_slug,
+            "ror_id": self.ror_id,
+            "extraction_methods": ";".join(self.extraction_methods),
+            "quality": self.quality
+        }
 
 
 def merge_rows(datasets: list) -> list:
     """
     Merge data across disparate sources, with one row per software-ROR pair
-    :param datasets: List of lists of records in the format shown in `reformat_orca_url_matches`, one per data source
-    :return: List of deduplicated records
+    :param datasets: List of iterables of records in the format shown in `reformat_orca_url_matches`, one per data
+           source
+    :return: List of deduplicated `LinkRecord`s, sorted by software name and ROR id
     """
     id_to_record = {}
     # we are iterating through a list of records containing our output rows (see format in `reformat_orca_url_matches`).
     # We're creating an id for each row based on the name of the software and the ror id. If this id is present in
-    # `id_to_record`, we will add the extraction method to the existing list. If not, we will add a new
+    # `id_to_record`, we will add the extraction method to the existing record. If not, we will add a new
     # record to `id_to_record`
     for dataset in datasets:
         for row in dataset:
-            row["software_name"] = row["software_name"].strip()
-            id = f"{row['software_name']}/{row['ror_id']}".lower()
-            extraction_method = row["extraction_method"]
-            if id in id_to_record:
-                if extraction_method not in id_to_record[id]["extraction_methods"]:
-                    id_to_record[id]["extraction_methods"].append(extraction_method)
-            else:
-                row["extraction_methods"] = [row.pop("extraction_method")]
-                id_to_record[id] = row
+            software_name = row["software_name"].strip()
+            id = f"{software_name}/{row['ror_id']}".lower()
+            record = id_to_record.get(id)
+            if record is None:
+                record = LinkRecord(software_name, row["github_slug"], row["ror_id"])
+                id_to_record[id] = record
+            record.add_method(row["extraction_method"])
+    return [id_to_record[id] for id in sorted(id_to_record)]
+
+
+def normalize_software_name(software_name: str) -> str:
+    """
+    Normalize a software name for near-duplicate detection, e.g. "Scikit Learn" and "scikit-learn" both become
+    "scikitlearn"
+    :param software_name: Software name
+    :return: Normalized name
+    """
+    return re.sub(r"[\W_]+", "", software_name.lower()) or software_name.lower()
+
+
+def normalize_github_slug(github_slug) -> str:
+    """
+    Get the GitHub slug of a record as a string. Records without a repository can have a slug of None, or of NaN when
+    their source was read with pandas
+    :param github_slug: GitHub slug of a record
+    :return: The slug, or "" if the record has none
+    """
+    return github_slug if isinstance(github_slug, str) else ""
+
+
+def name_shingles(normalized_name: str) -> set:
+    """
+    Get the character trigrams of a normalized software name
+    :param normalized_name: Output of `normalize_software_name`
+    :return: Set of trigrams, or the name itself if it is too short to have any
+    """
+    if len(normalized_name) < 3:
+        return {normalized_name}
+    return {normalized_name[i:i+3] for i in range(len(normalized_name) - 2)}
+
+
+def are_near_duplicate_names(name_a: str, name_b: str, shingles_a: set, shingles_b: set, threshold: float) -> bool:
+    """
+    Check whether two normalized software names are near-duplicates. Names that only differ in their digits are
+    versions or variants of each other rather than spellings of the same name, e.g. "bowtie" and "bowtie2", or
+    "tool3" and "tool32", so they never are
+    :param name_a: Output of `normalize_software_name`
+    :param name_b: Output of `normalize_software_name`
+    :param shingles_a: Output of `name_shingles` for `name_a`
+    :param shingles_b: Output of `name_shingles` for `name_b`
+    :param threshold: Minimum Jaccard similarity of the names' trigrams, raised to `SHORT_NAME_SIMILARITY_THRESHOLD`
+                      if either name is shorter than `SHORT_NAME_LENGTH`
+    :return: True if the names are near-duplicates
+    """
+    if re.sub(r"\d+", "", name_a) == re.sub(r"\d+", "", name_b):
+        return False
+    if min(len(name_a), len(name_b)) < SHORT_NAME_LENGTH:
+        threshold = max(threshold, SHORT_NAME_SIMILARITY_THRESHOLD)
+    return len(shingles_a & shingles_b) >= threshold * len(shingles_a | shingles_b)
+
+
+def minhash_signatures(shingle_sets: list, chunk_size: int = 100_000) -> np.ndarray:
+    """
+    Compute MinHash signatures of sets of shingles
+    :param shingle_sets: List of non-empty sets of strings
+    :param chunk_size: Number of sets to hash at once, which bounds the size of the intermediate arrays
+    :return: Array with one row of MINHASH_BANDS * MINHASH_ROWS hash values per set
+    """
+    # Each (a * x + b) % MINHASH_PRIME acts as a random permutation of shingle hashes. A fixed seed keeps
+    # signatures, and so clusters, stable between runs
+    rand = np.random.RandomState(0)
+    num_hashes = MINHASH_BANDS * MINHASH_ROWS
+    a = rand.randint(1, MINHASH_PRIME, size=(num_hashes, 1), dtype=np.int64)
+    b = rand.randint(0, MINHASH_PRIME, size=(num_hashes, 1), dtype=np.int64)
+    signatures = np.empty((len(shingle_sets), num_hashes), dtype=np.int64)
+    for start in range(0, len(shingle_sets), chunk_size):
+        chunk = shingle_sets[start:start+chunk_size]
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) % MINHASH_PRIME for shingles in chunk
+                           for shingle in shingles], dtype=np.int64)
+        offsets = np.cumsum([0] + [len(shingles) for shingles in chunk[:-1]])
+        permuted = (a * hashes + b) % MINHASH_PRIME
+        signatures[start:start+len(chunk)] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signatures
+
+
+def cluster_near_duplicate_names(records: list, threshold: float = NAME_SIMILARITY_THRESHOLD) -> tuple:
+    """
+    Cluster records linked to the same ROR id whose software names are near-duplicates, such as "scikit-learn" and
+    "Scikit Learn", and merge each cluster's extraction methods into a single record. Names are compared using
+    MinHash LSH over their character trigrams, blocked by ROR id, so the work grows roughly linearly with the number
+    of records rather than with the number of pairs of records. See `are_near_duplicate_names` for which names are
+    near-duplicates
+    :param records: List of `LinkRecord`s sorted by id, as returned by `merge_rows`
+    :param threshold: Minimum Jaccard similarity of two names' trigrams for them to be clustered
+    :return: Tuple of (list of merged records, still sorted by id, list of (ROR id, software name of the record a
+             cluster was merged into, software name of a record merged into it) tuples)
+    """
+    # Union-find over record positions. The root of each cluster is its first record in sort order, which keeps
+    # its software name. Records with different GitHub slugs are different software however similar their names, e.g.
+    # owner/repo1 and owner/repo17, so each cluster also tracks the slug of its records, if any
+    parent = list(range(len(records)))
+    slugs = [normalize_github_slug(record.github_slug).lower() for record in records]
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j or (slugs[root_i] and slugs[root_j] and slugs[root_i] != slugs[root_j]):
+            return
+        root, child = min(root_i, root_j), max(root_i, root_j)
+        parent[child] = root
+        slugs[root] = slugs[root] or slugs[child]
+
+    # Names that are identical once normalized are clustered outright, so only one record per normalized name and
+    # ROR id needs to go through LSH
+    normalized_to_record = {}
+    for i, record in enumerate(records):
+        key = (record.ror_id, normalize_software_name(record.software_name))
+        if key in normalized_to_record:
+            union(normalized_to_record[key], i)
+        else:
+            normalized_to_record[key] = i
+    ror_counts = Counter(ror_id for ror_id, _ in normalized_to_record)
+    normalized_names = {i: normalized_name for (ror_id, normalized_name), i in normalized_to_record.items()
+                        if ror_counts[ror_id] > 1}
+    shingles = {i: name_shingles(normalized_name) for i, normalized_name in normalized_names.items()}
+    candidates = list(shingles)
+    signatures = minhash_signatures([shingles[i] for i in candidates])
+    for band in range(MINHASH_BANDS):
+        buckets = {}
+        band_signatures = signatures[:, band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]
+        for i, band_signature in zip(candidates, band_signatures):
+            key = (records[i].ror_id, band_signature.tobytes())
+            if key not in buckets:
+                buckets[key] = []
+            buckets[key].append(i)
+        for members in buckets.values():
+            pairs = combinations(members, 2) if len(members) <= MAX_BUCKET_SIZE else zip(members, members[1:])
+            for i, j in pairs:
+                if are_near_duplicate_names(normalized_names[i], normalized_names[j], shingles[i], shingles[j],
+                                            threshold):
+                    union(i, j)
+
     merged = []
-    # Not casting aspersions, just noting that some methods return less ambiguous matches than others!
-    high_quality_methods = ["czi_affiliation_links", "joss_affiliation_links", "by_name", "human_curated"]
-    medium_quality_methods = ["ner_text_extraction", "url_matches"]
-    for _, record in id_to_record.items():
-        methods = record["extraction_methods"]
-        is_high_quality = len(methods) > 1 or any([m in high_quality_methods for m in methods])
-        is_medium_quality = len(methods) == 1 and any([m in medium_quality_methods for m in methods])
-        record["quality"] = 1 if is_high_quality else (0.5 if is_medium_quality else 0)
-        merged.append(record)
-    merged.sort(key=lambda row: f"{row['software_name']}/{row['ror_id']}".lower())
-    return merged
+    clusters = []
+    for i, record in enumerate(records):
+        root = find(i)
+        if root == i:
+            merged.append(record)
+            continue
+        if not normalize_github_slug(records[root].github_slug):
+            records[root].github_slug = record.github_slug
+        for method in record.extraction_methods:
+            records[root].add_method(method)
+        clusters.append((record.ror_id, records[root].software_name, record.software_name))
+    return merged, clusters
+
+
+def factorize_column(column: pd.Series) -> tuple:
+    """
+    Encode a column as integer codes into its distinct values
+    :param column: Series
+    :return: Tuple of (array of codes, distinct values). Missing values get a code of their own
+    """
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        return pd.factorize(column, use_na_sentinel=False)
+    # Categorical columns already are codes into their categories, with -1 for missing values
+    codes = column.cat.codes.to_numpy()
+    if (codes < 0).any():
+        return np.where(codes < 0, len(column.cat.categories), codes), np.append(
+            column.cat.categories.to_numpy(dtype=object), np.nan)
+    return codes, column.cat.categories
+
+
+def factorize_columns(columns: list) -> tuple:
+    """
+    Encode a column split over several DataFrames as integer codes into a single array of its distinct values
+    :param columns: List of Series
+    :return: Tuple of (list of arrays of codes, one per column, object array of distinct values)
+    """
+    codes = []
+    distinct_values = []
+    # Offsets of each array of distinct values in `distinct_values`, by identity, so categorical columns sharing their
+    # categories map them to shared codes only once
+    offsets = {}
+    for column in columns:
+        column_codes, column_values = factorize_column(column)
+        if id(column_values) not in offsets:
+            offsets[id(column_values)] = sum(len(values) for values in distinct_values)
+            distinct_values.append(column_values)
+        codes.append((offsets[id(column_values)], column_codes))
+    # Only the (few) distinct values of each column are factorized again to map them to shared codes
+    shared_codes, shared_values = pd.factorize(
+        np.concatenate([np.asarray(values, dtype=object) for values in distinct_values]), use_na_sentinel=False)
+    # Codes are the largest arrays the merge holds, so they are kept to 32 bits when there are few enough values
+    shared_codes = shared_codes.astype(np.int32 if len(shared_values) < 2 ** 31 else np.int64)
+    return [shared_codes[offset + column_codes] for offset, column_codes in codes], np.asarray(shared_values,
+                                                                                              dtype=object)
+
+
+def join_ids(names: np.ndarray, rors: np.ndarray) -> pd.Series:
+    """
+    Join normalized software names and ROR ids into the ids `merge_rows` gives records
+    :param names: Object array of lowercased, stripped software names
+    :param rors: Object array of lowercased ROR ids
+    :return: Series of ids
+    """
+    if ARROW_AVAILABLE:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        # Arrow compares strings by their UTF-8 bytes, which sorts them the same way as Python does
+        return pd.Series(pd.arrays.ArrowExtensionArray(pc.binary_join_element_wise(
+            pa.array(names, type=pa.string()), pa.array(rors, type=pa.string()), "/")))
+    return pd.Series([f"{name}/{ror}" for name, ror in zip(names, rors)], dtype=object)
+
+
+def take_rows(frames: list, column: str, rows: np.ndarray) -> np.ndarray:
+    """
+    Get the values of a column at some rows of DataFrames, as if they were concatenated
+    :param frames: List of DataFrames
+    :param column: Column name
+    :param rows: Array of row positions in the concatenated DataFrames
+    :return: Object array of values
+    """
+    frame_starts = np.cumsum([0] + [len(frame) for frame in frames])
+    frame_idx = np.searchsorted(frame_starts, rows, side="right") - 1
+    values = np.empty(len(rows), dtype=object)
+    for i, frame in enumerate(frames):
+        in_frame = frame_idx == i
+        values[in_frame] = frame[column].take(rows[in_frame] - frame_starts[i]).to_numpy(dtype=object)
+    return values
+
+
+def vectorized_merge_rows(frames: list) -> pd.DataFrame:
+    """
+    Merge data across disparate sources with the same semantics as `merge_rows`, but with vectorized operations over
+    whole columns rather than row by row. Columns are encoded as integer codes into their distinct values, so ids
+    are only normalized once per distinct software name and ROR id, and extraction methods are aggregated and
+    scored over integer arrays
+    :param frames: List of DataFrames with the columns in `INPUT_FIELDS`, one per data source, as returned by the
+           functions in `FRAME_REFORMATTERS`
+    :return: DataFrame with one row per software-ROR pair, with the columns in `OUTPUT_FIELDS`, in the same order as
+             the output of `merge_rows`. Extraction methods are already joined with semicolons
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=OUTPUT_FIELDS)
+    names, name_values = factorize_columns([frame["software_name"] for frame in frames])
+    rors, ror_values = factorize_columns([frame["ror_id"] for frame in frames])
+    methods, method_values = factorize_columns([frame["extraction_method"] for frame in frames])
+    methods = np.concatenate(methods)
+
+    # Ids are `merge_rows`' f"{software_name}/{ror_id}".lower(), encoded as a pair of codes of the normalized name
+    # and ROR id. Pairs are built a source at a time, as they take twice the memory of the codes
+    name_ids, id_names = pd.factorize(np.array([name.strip().lower() for name in name_values], dtype=object))
+    ror_ids, id_rors = pd.factorize(np.array([f"{ror}".lower() for ror in ror_values], dtype=object))
+    pairs = np.concatenate([name_ids[frame_names] * len(id_rors) + ror_ids[frame_rors]
+                            for frame_names, frame_rors in zip(names, rors)])
+    del names, rors
+    # Factorizing numbers the pairs, and then the ids, in the order they were first seen. Ids are only built for the
+    # distinct pairs, and distinct pairs can still share an id, e.g. "a/b" at "c" and "a" at "b/c"
+    codes, pairs = pd.factorize(pairs)
+    pair_names, pair_rors = np.divmod(pairs, len(id_rors))
+    id_codes, ids = pd.factorize(join_ids(np.asarray(id_names, dtype=object)[pair_names],
+                                          np.asarray(id_rors, dtype=object)[pair_rors]))
+    del pairs, pair_names, pair_rors
+    if len(ids) < len(id_codes):
+        codes = id_codes[codes]
+    num_ids = len(ids)
+    codes = codes.astype(np.int32 if num_ids < 2 ** 31 else np.int64)
+
+    # As in `merge_rows`, the first row seen for an id determines its software name and github slug
+    first_rows = pd.Series(codes).drop_duplicates().index.to_numpy()
+    software_names = np.array([name.strip() for name in take_rows(frames, "software_name", first_rows)],
+                              dtype=object)
+    slugs = take_rows(frames, "github_slug", first_rows)
+    ror_id_values = take_rows(frames, "ror_id", first_rows)
+    del first_rows
+
+    # Each id's distinct methods, in the order they were first seen, are folded into a code for their sequence, one
+    # position at a time
+    num_methods = len(method_values)
+    id_methods = pd.unique(codes.astype(np.int64) * num_methods + methods)
+    del codes, methods
+    method_ids, id_methods = np.divmod(id_methods, num_methods)
+    positions = pd.Series(method_ids).groupby(method_ids, sort=False).cumcount().to_numpy()
+    sequences = np.zeros(num_ids, dtype=np.int64)
+    sequence_methods = [()]
+    for position in range(positions.max() + 1):
+        at_position = positions == position
+        next_methods = np.zeros(num_ids, dtype=np.int64)
+        next_methods[method_ids[at_position]] = id_methods[at_position] + 1
+        sequences, extended = pd.factorize(sequences * (num_methods + 1) + next_methods)
+        sequence_methods = [sequence_methods[code // (num_methods + 1)] + (
+            (code % (num_methods + 1) - 1,) if code % (num_methods + 1) else ()) for code in extended]
+    extraction_methods = np.array([";".join(method_values[code] for code in sequence)
+                                   for sequence in sequence_methods], dtype=object)
+    # Quality only depends on the set of methods, so `LinkRecord` scores each distinct set once. Its values mix ints
+    # and floats, so they are kept as objects for the output formatting to match
+    set_quality = {}
+    for sequence in sequence_methods:
+        if frozenset(sequence) not in set_quality:
+            record = LinkRecord("", "", "", [method_values[code] for code in sequence])
+            set_quality[frozenset(sequence)] = record.quality
+    quality = np.array([set_quality[frozenset(sequence)] for sequence in sequence_methods], dtype=object)
+
+    order = ids.argsort()
+    return pd.DataFrame({
+        "software_name": software_names[order],
+        "github_slug": slugs[order],
+        "ror_id": ror_id_values[order],
+        "extraction_methods": extraction_methods[sequences[order]],
+        "quality": quality[sequences[order]]
+    }, columns=OUTPUT_FIELDS)
+
+
+def write_merged_frame(merged: pd.DataFrame, output_csv: str, output_json: str, output_parquet: str = None) -> tuple:
+    """
+    Write the output of `vectorized_merge_rows` in the same formats `write_reformatted` writes merged records in
+    :param merged: Output of `vectorized_merge_rows`
+    :param output_csv: File where output csv should be written
+    :param output_json: File where output json should be written
+    :param output_parquet: If set, file where output parquet should be written
+    :return: Tuple of (number of rows written, set of distinct ROR ids, set of distinct GitHub repositories, leaving
+             out missing slugs as `normalize_github_slug` does)
+    """
+    with open(output_csv, mode="w") as f:
+        writer = csv.writer(f)
+        writer.writerow(OUTPUT_FIELDS)
+        writer.writerows(zip(*[merged[field] for field in OUTPUT_FIELDS]))
+
+    # Group rows by ROR id, with ROR ids in the order they first appear
+    ror_codes, rors = pd.factorize(merged["ror_id"])
+    by_ror = merged.iloc[ror_codes.argsort(kind="stable")]
+    write_ror_json(((ror, software_name, {
+        "github_slug": github_slug,
+        "extraction_methods": extraction_methods,
+        "quality": quality
+    }) for software_name, github_slug, ror, extraction_methods, quality in zip(
+        *[by_ror[field] for field in OUTPUT_FIELDS])), output_json)
+    if output_parquet:
+        by_ror = merged.sort_values("ror_id", kind="stable")
+        write_parquet((dict(zip(OUTPUT_FIELDS, row)) for row in zip(*[by_ror[field] for field in OUTPUT_FIELDS])),
+                      output_parquet)
+    return len(merged), rors, set(map(normalize_github_slug, merged["github_slug"])) - {""}
+
+
+def spill_sorted_runs(rows: iter, run_size: int, run_dir: str, prefix: str = "run") -> list:
+    """
+    Sort rows in chunks of at most `run_size` and write each sorted chunk to its own file as JSON lines
+    :param rows: Iterable of JSON-serializable lists, which are sorted by their elements in order
+    :param run_size: Maximum number of rows to hold in memory at once
+    :param run_dir: Directory where run files should be written
+    :param prefix: Prefix of run file names, so several processes can spill runs to the same directory
+    :return: List of paths of run files
+    """
+    run_files = []
+    buffer = []
+
+    def spill():
+        buffer.sort()
+        run_file = os.path.join(run_dir, f"{prefix}_{len(run_files)}.jsonl")
+        with open(run_file, mode="w") as out:
+            for row in buffer:
+                out.write(json.dumps(row)+"\n")
+        run_files.append(run_file)
+        buffer.clear()
+
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= run_size:
+            spill()
+    if buffer:
+        spill()
+    return run_files
+
+
+def read_run(run_file: str) -> iter:
+    """
+    Read back a run written by `spill_sorted_runs`
+    :param run_file: Path to run file
+    :return: Generator of rows
+    """
+    with open(run_file) as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def external_sort(rows: iter, run_size: int = DEFAULT_RUN_SIZE, tmp_dir: str = None) -> iter:
+    """
+    Sort rows that may not fit in memory by spilling sorted runs to disk and k-way merging them
+    :param rows: Iterable of JSON-serializable lists, which are sorted by their elements in order
+    :param run_size: Maximum number of rows to hold in memory at once
+    :param tmp_dir: Directory where temporary run files should be written. Uses the system default if None
+    :return: Generator of sorted rows
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        run_files = spill_sorted_runs(rows, run_size, run_dir)
+        yield from heapq.merge(*[read_run(run_file) for run_file in run_files])
+
+
+def read_source(source: tuple) -> iter:
+    """
+    Read the reformatted records of a data source
+    :param source: Tuple of (source name, list of input files, reformat function, arguments to the reformat function)
+    :return: Generator of reformatted records
+    """
+    _, _, reformat, reformat_args = source
+    return reformat(*reformat_args)
+
+
+def read_source_frame(source: tuple) -> pd.DataFrame:
+    """
+    Read the reformatted records of a data source into a DataFrame, for `vectorized_merge_rows`
+    :param source: Tuple in the format described in `read_source`
+    :return: DataFrame with the columns in `INPUT_FIELDS`
+    """
+    _, _, reformat, reformat_args = source
+    if reformat in FRAME_REFORMATTERS:
+        return FRAME_REFORMATTERS[reformat](*reformat_args)
+    return pd.DataFrame(list(reformat(*reformat_args)), columns=INPUT_FIELDS, dtype=object)
+
+
+def read_source_to_list(source: tuple) -> list:
+    """
+    Read all reformatted records of a data source into a list, so they can be returned from a worker process
+    :param source: Tuple in the format described in `read_source`
+    :return: List of reformatted records
+    """
+    return list(read_source(source))
+
+
+def map_sources(func, items: list, workers: int = 1) -> list:
+    """
+    Apply a function to each item, in a pool of worker processes if `workers` is greater than 1
+    :param func: Function to apply. Must be defined at module level, so it can be sent to worker processes
+    :param items: Items to apply the function to
+    :param workers: Number of worker processes
+    :return: List of results, in the order of `items`
+    """
+    if workers > 1 and len(items) > 1:
+        with Pool(min(workers, len(items))) as p:
+            return p.map(func, items)
+    return [func(item) for item in items]
+
+
+def spill_source(data: tuple) -> list:
+    """
+    Read a data source and spill its rows to disk in runs sorted by software_name/ror_id, for `stream_merge_rows`
+    :param data: Tuple of (source in the format described in `read_source`, position of the source in the list of
+           sources, run size, directory where run files should be written)
+    :return: List of paths of run files
+    """
+    source, source_idx, run_size, run_dir = data
+
+    def keyed_rows():
+        # The source position and sequence number break ties between rows with the same id, so the first row we
+        # see for an id still determines its software name and github slug, and extraction methods keep the order
+        # they were seen in
+        for seq, row in enumerate(read_source(source)):
+            software_name = row["software_name"].strip()
+            id = f"{software_name}/{row['ror_id']}".lower()
+            yield [id, source_idx, seq, software_name, row["github_slug"], row["ror_id"], row["extraction_method"]]
+
+    return spill_sorted_runs(keyed_rows(), run_size, run_dir, prefix=f"source_{source_idx}")
+
+
+def stream_merge_rows(sources: list, run_size: int = DEFAULT_RUN_SIZE, tmp_dir: str = None,
+                      workers: int = 1) -> iter:
+    """
+    Merge data across disparate sources with the same semantics as `merge_rows`, but with memory use bounded by
+    `run_size` rather than by the size of the input
+    :param sources: List of sources in the format described in `read_source`, in the order they should be merged
+    :param run_size: Maximum number of rows each worker holds in memory at once
+    :param tmp_dir: Directory where temporary run files should be written. Uses the system default if None
+    :param workers: Number of worker processes used to read and sort sources concurrently
+    :return: Generator of deduplicated `LinkRecord`s, in the same order as the output of `merge_rows`
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+        source_run_files = map_sources(spill_source, [(source, source_idx, run_size, run_dir)
+                                                      for source_idx, source in enumerate(sources)], workers)
+        sorted_rows = heapq.merge(*[read_run(run_file) for run_files in source_run_files for run_file in run_files])
+        yield from merge_sorted_rows((id, software_name, github_slug, ror_id, extraction_method)
+                                     for id, _, _, software_name, github_slug, ror_id, extraction_method in sorted_rows)
+
+
+def merge_sorted_rows(rows: iter) -> iter:
+    """
+    Merge rows that are already sorted by id, and within an id, in the order the rows were seen in the input
+    :param rows: Iterable of (id, software name, github slug, ror id, extraction method) tuples
+    :return: Generator of deduplicated `LinkRecord`s
+    """
+    record = None
+    current_id = None
+    for id, software_name, github_slug, ror_id, extraction_method in rows:
+        if id != current_id:
+            if record is not None:
+                yield record
+            current_id = id
+            record = LinkRecord(software_name, github_slug, ror_id)
+        record.add_method(extraction_method)
+    if record is not None:
+        yield record
+
+
+def json_key(key) -> str:
+    """
+    Serialize a value as a JSON object key, the way `json.dumps` would
+    :param key: Key to serialize
+    :return: Serialized key
+    """
+    # json.dumps converts non-string keys such as floats to strings before quoting them
+    return json.dumps(key if isinstance(key, str) else json.dumps(key))
+
+
+def write_ror_json(rows: iter, output_json: str) -> None:
+    """
+    Write rows grouped by ROR id as a JSON object mapping ROR ids to software names to software metadata, one
+    entry at a time, so neither the object nor its serialization is ever held in memory as a whole. The output is
+    identical to `json.dumps(ror_to_software, indent=2)`
+    :param rows: Iterable of (ror id, software name, software metadata) tuples. Rows with the same ROR id must be
+           adjacent
+    :param output_json: File where output json should be written
+    :return: None
+    """
+    with open(output_json, mode="w") as f:
+        current_ror = None
+        f.write("{")
+        for ror, software_name, metadata in rows:
+            if ror != current_ror:
+                if current_ror is not None:
+                    f.write("\n  },")
+                f.write(f"\n  {json_key(ror)}: {{")
+                current_ror = ror
+            else:
+                f.write(",")
+            entry = json.dumps(metadata, indent=2).replace("\n", "\n    ")
+            f.write(f"\n    {json_key(software_name)}: {entry}")
+        f.write("\n  }\n}" if current_ror is not None else "}")
+
+
+def write_parquet(rows: iter, output_parquet: str, row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> None:
+    """
+    Write merged records to Parquet in row groups of `row_group_size` rows. As the rows are sorted by ROR id, the
+    min/max statistics kept for each row group let readers filtering on a ROR id skip every other row group.
+    Requires pyarrow
+    :param rows: Iterable of records in the format written to the output csv, sorted by ROR id
+    :param output_parquet: File where output parquet should be written
+    :param row_group_size: Number of rows in each row group
+    :return: None
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("software_name", pa.string()),
+        ("github_slug", pa.string()),
+        ("ror_id", pa.string()),
+        ("extraction_methods", pa.list_(pa.string())),
+        ("quality", pa.float64())
+    ])
+
+    def write_row_group(batch):
+        columns = {field: [row[field] for row in batch] for field in OUTPUT_FIELDS}
+        columns["extraction_methods"] = [methods.split(";") for methods in columns["extraction_methods"]]
+        # from_pandas makes pyarrow read NaN, which pandas uses for missing values, as null
+        writer.write_table(pa.table([pa.array(columns[field.name], type=field.type, from_pandas=True)
+                                     for field in schema], schema=schema), row_group_size=row_group_size)
+
+    with pq.ParquetWriter(output_parquet, schema, write_statistics=True) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                write_row_group(batch)
+                batch = []
+        if batch:
+            write_row_group(batch)
+
+
+def fingerprint(paths: list) -> str:
+    """
+    Fingerprint the contents of a list of files
+    :param paths: Paths of files to fingerprint
+    :return: Hex digest of the files' contents
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, mode="rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stats(paths: list) -> str:
+    """
+    Get the sizes and modification times of a list of files, which change whenever their contents do
+    :param paths: Paths of files
+    :return: json list of (size, modification time in ns) pairs
+    """
+    return json.dumps([(stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, paths)])
+
+
+def update_merged_state(state_db: str, sources: list, workers: int = 1) -> iter:
+    """
+    Bring a persistent merged-state store up to date with the sources, re-reading only the sources whose input files
+    have changed since the last run, and return the merged records. Input files are only fingerprinted again if their
+    size or modification time changed
+    :param state_db: Path to the SQLite database holding the merged state. Created if it does not exist
+    :param sources: List of sources in the format described in `read_source`, in the order they should be merged
+    :param workers: Number of worker processes used to fingerprint and read sources concurrently
+    :return: Generator of deduplicated `LinkRecord`s, in the same order as the output of `merge_rows`
+    """
+    conn = sqlite3.connect(state_db)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != STATE_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS sources; DROP TABLE IF EXISTS source_rows; "
+                           "DROP TABLE IF EXISTS merged;")
+        conn.execute(f"PRAGMA user_version = {STATE_VERSION}")
+    conn.executescript(STATE_SCHEMA)
+    conn.execute("CREATE TEMP TABLE affected (id TEXT PRIMARY KEY)")
+    known = {name: (idx, fp, stats)
+             for name, idx, fp, stats in conn.execute("SELECT name, idx, fingerprint, stats FROM sources")}
+    stats = [file_stats(input_files) for _, input_files, _, _ in sources]
+    # Sources whose files kept their sizes and modification times keep their fingerprint, the others are hashed again
+    fingerprints = {idx: known[name][1] for idx, (name, _, _, _) in enumerate(sources)
+                    if name in known and (known[name][0], known[name][2]) == (idx, stats[idx])}
+    rehashed = [idx for idx in range(len(sources)) if idx not in fingerprints]
+    fingerprints.update(zip(rehashed, map_sources(fingerprint, [sources[idx][1] for idx in rehashed], workers)))
+    changed = []
+    for idx, source in enumerate(sources):
+        if known.get(source[0], (None, None))[:2] == (idx, fingerprints[idx]):
+            print(f"Source {source[0]} is unchanged, skipping")
+        else:
+            changed.append((idx, source, fingerprints[idx]))
+    if workers > 1:
+        changed_records = map_sources(read_source_to_list, [source for _, source, _ in changed], workers)
+    else:
+        changed_records = [read_source(source) for _, source, _ in changed]
+    with conn:
+        # Sources rewritten with the same contents, e.g. copied, only need their new sizes and modification times
+        conn.executemany("UPDATE sources SET stats = ? WHERE name = ?",
+                         ((stats[idx], sources[idx][0]) for idx in rehashed))
+        for (idx, (name, _, _, _), fp), records in zip(changed, changed_records):
+            print(f"Re-ingesting source {name}")
+            # Retract the stale rows of this source, remembering which records they contributed to
+            conn.execute("INSERT OR IGNORE INTO affected SELECT id FROM source_rows WHERE source = ?", (name,))
+            conn.execute("DELETE FROM source_rows WHERE source = ?", (name,))
+            conn.executemany("INSERT INTO source_rows VALUES (?, ?, ?, ?, ?, ?)", (
+                (name, idx, seq, f"{row['software_name'].strip()}/{row['ror_id']}".lower(), row["extraction_method"],
+                 json.dumps([row["software_name"].strip(), row["github_slug"], row["ror_id"]]))
+                for seq, row in enumerate(records)))
+            conn.execute("INSERT OR IGNORE INTO affected SELECT id FROM source_rows WHERE source = ?", (name,))
+            conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)", (name, idx, fp, stats[idx]))
+        # Recompute the merged records, including their quality, for the affected ids only. Ids that no longer have
+        # any rows are dropped along the way
+        conn.execute("DELETE FROM merged WHERE id IN (SELECT id FROM affected)")
+        affected_rows = conn.execute("SELECT source_rows.id, record, method FROM source_rows "
+                                     "JOIN affected ON source_rows.id = affected.id "
+                                     "ORDER BY source_rows.id, source_idx, seq")
+        # Methods are stored by name rather than code, as codes of methods registered at runtime can change
+        # between runs
+        conn.executemany("INSERT INTO merged VALUES (?, ?)", (
+            (f"{record.software_name}/{record.ror_id}".lower(),
+             json.dumps([record.software_name, record.github_slug, record.ror_id, record.extraction_methods]))
+            for record in merge_sorted_rows((id, *json.loads(record), method) for id, record, method in affected_rows)))
+        conn.execute("DELETE FROM affected")
+    try:
+        # SQLite compares text by its UTF-8 bytes, which orders ids the same way as sorting them in Python
+        for record, in conn.execute("SELECT record FROM merged ORDER BY id"):
+            yield LinkRecord(*json.loads(record))
+    finally:
+        conn.close()
 
 
 def write_reformatted(orca_url_matches: str, orca_data: str, stack_readme_matches: str, working_curated: str,
                       czi_software_rors: str, joss_software_rors: str, openaire_czi_matches: str, output_csv: str,
-                      output_json: str):
+                      output_json: str, streaming: bool = False, run_size: int = DEFAULT_RUN_SIZE,
+                      tmp_dir: str = None, state_db: str = None, workers: int = 1, vectorized: bool = False,
+                      output_parquet: str = None, orca_index: str = None, name_clusters_csv: str = None):
     """
     Merge data from disparate sources and write out in a single CSV
     :param orca_url_matches: matches from repo owner urls to ROR urls
@@ -188,45 +1215,142 @@ def write_reformatted(orca_url_matches: str, orca_data: str, stack_readme_matche
            and CZI DOI-to-software mentions
     :param output_csv: File where output csv should be written
     :param output_json: File where output json should be written
+    :param streaming: If true, merge with `stream_merge_rows`, so memory use does not grow with the size of the input
+    :param run_size: Maximum number of rows to hold in memory at once in streaming mode
+    :param tmp_dir: Directory where temporary files should be written in streaming mode
+    :param state_db: If set, path to a persistent merged-state store. Only sources whose input files changed since the
+           last run against this store are re-read
+    :param workers: Number of worker processes used to read sources concurrently
+    :param vectorized: If true, read each source into a DataFrame with `read_source_frame` and merge with
+           `vectorized_merge_rows`. Ignored in streaming mode or if `state_db` is set
+    :param output_parquet: If set, file where output parquet, sorted by ROR id, should be written
+    :param orca_index: If set, path to an index of `orca_data` built by `build_orca_index`, read instead of
+           `orca_data`. Built if it does not exist yet or is older than `orca_data`
+    :param name_clusters_csv: If set, merge records linked to the same ROR id whose software names are near-duplicates
+           using `cluster_near_duplicate_names`, and write the names that were merged to this file. Not supported in
+           streaming or vectorized mode
     :return: None
     """
-    orca = reformat_orca_url_matches(orca_url_matches, orca_data)
-    stack_readme = reformat_stack_readme_matches(stack_readme_matches)
-    working = reformat_working_curated(working_curated)
-    czi_affiliations = reformat_czi_affiliation_rors(czi_software_rors)
-    joss_affiliations = reformat_joss_affiliation_rors(joss_software_rors)
-    openaire_czi_matches = reformat_openaire_czi_matches(openaire_czi_matches)
-    # To add another dataset, write a reformat_<your data> function to put data in the format shown in
-    # `reformat_orca_url_matches`, then put the output in the array below
-    merged_rows = merge_rows([orca, stack_readme, working, czi_affiliations, joss_affiliations, openaire_czi_matches])
-
-    rors = set()
-    software = set()
-    with open(output_csv, mode="w") as f:
-        writer = csv.DictWriter(f, fieldnames=["software_name", "github_slug", "ror_id", "extraction_methods",
-                                               "quality"])
-        writer.writeheader()
-        for row in merged_rows:
-            rors.add(row["ror_id"])
-            if row["github_slug"]:
-                software.add(row["github_slug"])
-            row["extraction_methods"] = ";".join(row["extraction_methods"])
-            writer.writerow(row)
-    print(f"Wrote {len(merged_rows)} software-ror links containing {len(rors)} distinct ROR ids and "
-          f"{len(software)} distinct GitHub repositories")
-
-    ror_to_software = {}
-    for row in merged_rows:
-        ror = row["ror_id"]
-        if ror not in ror_to_software:
-            ror_to_software[ror] = {}
-        ror_to_software[ror][row["software_name"]] = {
+    if name_clusters_csv and (streaming or vectorized):
+        raise ValueError("Clustering near-duplicate software names is not supported in streaming or vectorized mode")
+    # Each source is a name, the input files it is read from, and a function returning a generator of its
+    # reformatted records along with that function's arguments. To add another dataset, write a
+    # reformat_<your data> function to put data in the format shown in `reformat_orca_url_matches`, then add it to
+    # the list below
+    chunksize = run_size if streaming or state_db else None
+    use_arrow = ARROW_AVAILABLE and not chunksize
+    sources = [
+        ("orca", [orca_url_matches, orca_data], reformat_orca_url_matches, (orca_url_matches, orca_data, orca_index)),
+        ("stack_readme", [stack_readme_matches], reformat_stack_readme_matches, (stack_readme_matches, use_arrow)),
+        ("working_curated", [working_curated], reformat_working_curated, (working_curated,)),
+        ("czi_affiliations", [czi_software_rors], reformat_czi_affiliation_rors, (czi_software_rors,)),
+        ("joss_affiliations", [joss_software_rors], reformat_joss_affiliation_rors, (joss_software_rors,)),
+        ("openaire_czi", [openaire_czi_matches], reformat_openaire_czi_matches,
+         (openaire_czi_matches, chunksize, use_arrow)),
+    ]
+    if state_db:
+        merged_rows = update_merged_state(state_db, sources, workers)
+    elif streaming:
+        merged_rows = stream_merge_rows(sources, run_size, tmp_dir, workers)
+    elif vectorized:
+        merged_rows = vectorized_merge_rows(map_sources(read_source_frame, sources, workers))
+    else:
+        if workers > 1:
+            datasets = map_sources(read_source_to_list, sources, workers)
+        else:
+            datasets = [read_source(source) for source in sources]
+        merged_rows = merge_rows(datasets)
+    vectorized = vectorized and not (state_db or streaming)
+    if name_clusters_csv:
+        merged_rows, clusters = cluster_near_duplicate_names(list(merged_rows))
+        with open(name_clusters_csv, mode="w") as f:
+            writer = csv.writer(f)
+            writer.writerow(["ror_id", "software_name", "merged_software_name"])
+            writer.writerows(clusters)
+        print(f"Merged {len(clusters)} near-duplicate software names into another name linked to the same ROR id")
+
+    num_rows = 0
+
+    def write_csv():
+        # Write each merged row to the csv, then pass it on along with its position
+        nonlocal num_rows
+        with open(output_csv, mode="w") as f:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS)
+            writer.writeheader()
+            for record in merged_rows:
+                row = record.to_row()
+                writer.writerow(row)
+                yield num_rows, row
+                num_rows += 1
+
+    if vectorized:
+        num_rows, rors, software = write_merged_frame(merged_rows, output_csv, output_json, output_parquet)
+        num_rors, num_software = len(rors), len(software)
+    elif streaming:
+        # We can't hold the rows in memory to group them by ROR id, nor their ROR ids and repositories to count them,
+        # so we sort them on disk instead. A first sort orders rows by ROR id, for the Parquet output and to find the
+        # position of the first row of each ROR id, and repositories by slug, to count them. Each output has its own
+        # tag, so they all share that sort. A second sort then orders rows by the position of the first row of their
+        # ROR id, and groups them by ROR id in the order ROR ids first appear, for the JSON output. Each sort
+        # consumes its whole input before yielding its first row
+        num_rors = 0
+        num_software = 0
+
+        def tagged_rows():
+            for idx, row in write_csv():
+                yield ["json", row["ror_id"], idx, row["software_name"], {
+                    "github_slug": row["github_slug"],
+                    "extraction_methods": row["extraction_methods"],
+                    "quality": row["quality"]
+                }]
+                if output_parquet:
+                    yield ["parquet", row["ror_id"], idx, row]
+                github_slug = normalize_github_slug(row["github_slug"])
+                if github_slug:
+                    yield ["slug", github_slug]
+
+        def first_position_rows(rows):
+            # Rows are sorted by ROR id then position, so the first row of each ROR id has the lowest position
+            nonlocal num_rors
+            for ror, ror_rows in groupby(rows, key=lambda row: row[1]):
+                num_rors += 1
+                first_idx = None
+                for _, _, idx, software_name, metadata in ror_rows:
+                    first_idx = idx if first_idx is None else first_idx
+                    yield [first_idx, idx, ror, software_name, metadata]
+
+        written = set()
+        for output, rows in groupby(external_sort(tagged_rows(), run_size, tmp_dir), key=lambda row: row[0]):
+            if output == "json":
+                write_ror_json(((ror, software_name, metadata) for _, _, ror, software_name, metadata in
+                                external_sort(first_position_rows(rows), run_size, tmp_dir)), output_json)
+            elif output == "parquet":
+                write_parquet((row for _, _, _, row in rows), output_parquet)
+            else:
+                num_software = sum(1 for _ in groupby(rows))
+            written.add(output)
+        if "json" not in written:
+            write_ror_json([], output_json)
+        if output_parquet and "parquet" not in written:
+            write_parquet([], output_parquet)
+    else:
+        merged_rows = [row for _, row in write_csv()]
+        rors = {}
+        for idx, row in enumerate(merged_rows):
+            rors.setdefault(row["ror_id"], idx)
+        num_rors = len(rors)
+        num_software = len({normalize_github_slug(row["github_slug"]) for row in merged_rows} - {""})
+        # Sorting by the position of the first row for each ROR id groups rows by ROR id, with ROR ids in the order
+        # they first appear
+        write_ror_json(((row["ror_id"], row["software_name"], {
             "github_slug": row["github_slug"],
             "extraction_methods": row["extraction_methods"],
             "quality": row["quality"]
-        }
-    with open(output_json, mode="w") as f:
-        f.write(json.dumps(ror_to_software, indent=2))
+        }) for row in sorted(merged_rows, key=lambda row: rors[row["ror_id"]])), output_json)
+        if output_parquet:
+            write_parquet(sorted(merged_rows, key=lambda row: row["ror_id"]), output_parquet)
+    print(f"Wrote {num_rows} software-ror links containing {num_rors} distinct ROR ids and "
+          f"{num_software} distinct GitHub repositories")
 
 
 if __name__ == "__main__":
@@ -234,6 +1358,8 @@ if __name__ == "__main__":
     parser.add_argument("--orca_url_matches",
                         default=os.path.join("github_org_url_matching_pipeline", "orca_org_rors.json"))
     parser.add_argument("--orca_data", default=os.path.join("github_org_url_matching_pipeline", "orca_download.jsonl"))
+    parser.add_argument("--orca_index", help="Per-owner index of the ORCA data, so repeat runs don't reparse it. "
+                                             "Built from --orca_data if it does not exist yet")
     parser.add_argument("--stack_readme_affiliations",
                         default=os.path.join("ner_text_extraction_pipeline", "links.csv"))
     parser.add_argument("--working_curated", default=os.path.join("scicrunch", "scicrunch_working_file_minimal.csv"))
@@ -246,8 +1372,25 @@ if __name__ == "__main__":
     # add more arguments to ingest more data sources
     parser.add_argument("--output_csv", default=os.path.join("..", "software_to_ror.csv"))
     parser.add_argument("--output_json", default=os.path.join("..", "software_to_ror.json"))
+    parser.add_argument("--streaming", action="store_true",
+                        help="Merge by spilling sorted runs to disk, so memory use doesn't grow with the input size")
+    parser.add_argument("--run_size", type=int, default=DEFAULT_RUN_SIZE,
+                        help="Maximum number of rows held in memory at once in streaming mode")
+    parser.add_argument("--tmp_dir", help="Directory for temporary files in streaming mode")
+    parser.add_argument("--state_db", help="SQLite database holding merged state from previous runs. If set, only "
+                                           "sources whose input files changed are re-read")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes used to read data sources concurrently")
+    parser.add_argument("--vectorized", action="store_true",
+                        help="Merge with vectorized pandas operations rather than row by row")
+    parser.add_argument("--output_parquet", help="If set, also write the output as Parquet, sorted by ROR id")
+    parser.add_argument("--name_clusters_csv",
+                        help="If set, merge near-duplicate software names linked to the same ROR id, e.g. "
+                             "scikit-learn and Scikit Learn, and write the names that were merged to this file")
     args = parser.parse_args()
 
     write_reformatted(args.orca_url_matches, args.orca_data, args.stack_readme_affiliations, args.working_curated,
                       args.czi_software_rors, args.joss_software_rors, args.openaire_czi_matches, args.output_csv,
-                      args.output_json)
+                      args.output_json, args.streaming, args.run_size, args.tmp_dir, args.state_db,
+                      args.workers, args.vectorized, args.output_parquet,
+                      args.orca_index, args.name_clusters_csv)
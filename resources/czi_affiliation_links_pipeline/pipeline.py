@@ -1,20 +1,100 @@
 import argparse
+import asyncio
 import boto3
 import csv
+import functools
+import hashlib
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+import random
 import re
-import requests
+import sys
+import tempfile
 import xml.etree.ElementTree as ET
 
+from array import array
 from botocore import UNSIGNED
 from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from multiprocessing.pool import Pool
+from pmc_archive_index import ArchiveReader, build_index
 
+sys.path.append("..")
 
-s3_client = boto3.client("s3", config=Config(signature_version=UNSIGNED))
+from utils import ror_lookup
+
+
+def create_s3_client(endpoint_url=None, max_pool_connections=10):
+    """
+    Create an anonymous S3 client.
+
+    :param endpoint_url: URL of an S3-compatible service to use instead of AWS,
+        for example a local stand-in such as moto or MinIO
+    :param max_pool_connections: Maximum number of connections the client keeps
+        open, which limits how many requests it can have in flight
+    :return: S3 client
+    """
+
+    config = Config(
+        signature_version=UNSIGNED, max_pool_connections=max_pool_connections
+    )
+    return boto3.client("s3", endpoint_url=endpoint_url, config=config)
+
+
+s3_client = create_s3_client()
+# If set, articles are read from local PMC OA bulk packages instead of S3
+pmc_archive_reader = None
 
 PMC_BUCKET = "pmc-oa-opendata"
-OPENALEX_URL = "https://api.openalex.org"
+DEFAULT_CACHE_SIZE = 10 * 2**30
+# Articles are fetched with blocking boto3 calls, each holding one I/O thread
+# for its whole round-trip, so the number fetched at once is capped to keep
+# the number of threads reasonable
+MAX_CONCURRENCY = 128
+# Base delay in seconds before retrying a failed fetch, doubled on each attempt
+RETRY_BACKOFF = 1
+REFERENCE_ID_REGEX = re.compile(r"[1-9]\d*")
+MENTION_COLUMNS = ["ID", "software", "text", "pmcid", "curation_label"]
+# Fields of the mentions kept once they are grouped by article. The text of a
+# mention is only needed to find its citation number, and is most of its size
+GROUPED_MENTION_COLUMNS = ["ID", "software", "pmcid"]
+MENTION_CHUNK_SIZE = 100_000
+# If pyarrow is installed, mentions are parsed with its streaming csv reader, which
+# is several times faster than pandas' own
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+
+def init_s3_client(endpoint_url, max_pool_connections=10):
+    """
+    Replace the module's S3 client.
+
+    :param endpoint_url: URL of an S3-compatible service, or None for AWS
+    :param max_pool_connections: Maximum number of connections the client keeps
+        open
+    """
+
+    global s3_client
+    s3_client = create_s3_client(endpoint_url, max_pool_connections)
+
+
+@functools.lru_cache(maxsize=100_000)
+def get_citation_regex(software):
+    """
+    Get the regex matching a formal citation of a piece of software. Software
+    names repeat across mentions, so compiled regexes are reused.
+
+    :param software: Software name
+    :return: Compiled regex
+    """
+
+    return re.compile(re.escape(software) + r" *\[([1-9]\d*)")
 
 
 def extract_citation_number(mention):
@@ -27,84 +107,343 @@ def extract_citation_number(mention):
     :return: Formal citation number or None
     """
 
-    regex = re.escape(mention["software"]) + " *\[([1-9]\d*)"
-    matched = re.search(regex, mention["text"])
+    matched = get_citation_regex(mention["software"]).search(mention["text"])
     return matched.group(1) if matched else None
 
 
-def generate_mentions(file_path):
+def read_mention_chunks(file_path, chunksize=MENTION_CHUNK_SIZE):
     """
-    Generator of software mention objects.
+    Generator of chunks of the mentions TSV. Only the columns the pipeline uses
+    are parsed, all as strings.
 
     :param file_path: File path of a TSV file from CZI dataset
-    :return: Software mention objects
+    :param chunksize: Number of rows to read at once, if pyarrow is not installed
+    :return: DataFrames of rows
     """
 
-    with open(file_path, "r") as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        for mention in reader:
-            if "software" == mention["curation_label"]:
-                yield mention
+    if not ARROW_AVAILABLE:
+        yield from pd.read_csv(
+            file_path,
+            sep="\t",
+            usecols=MENTION_COLUMNS,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=chunksize,
+        )
+        return
+
+    import pyarrow.csv
+
+    reader = pyarrow.csv.open_csv(
+        file_path,
+        parse_options=pyarrow.csv.ParseOptions(delimiter="\t", newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(
+            include_columns=MENTION_COLUMNS,
+            column_types={column: "string" for column in MENTION_COLUMNS},
+            strings_can_be_null=False,
+        ),
+    )
+    for batch in reader:
+        yield batch.to_pandas()
+
+
+def generate_mentions(file_path, chunksize=MENTION_CHUNK_SIZE):
+    """
+    Generator of chunks of software mentions.
+
+    :param file_path: File path of a TSV file from CZI dataset
+    :param chunksize: Number of rows to read at once, if pyarrow is not installed
+    :return: DataFrames of software mentions
+    """
+
+    for chunk in read_mention_chunks(file_path, chunksize):
+        yield chunk[chunk["curation_label"] == "software"]
 
 
-def generate_mentions_with_citations(file_path):
+def generate_mentions_with_citations(file_path, chunksize=MENTION_CHUNK_SIZE):
     """
     Generator of software mentions with a formal citation.
 
     :param file_path: File path of a TSV file from CZI dataset
+    :param chunksize: Number of rows to read at once, if pyarrow is not installed
     :return: Tuples (software mention object, formal citation number)
     """
 
-    for mention in generate_mentions(file_path):
-        cit_num = extract_citation_number(mention)
-        if cit_num is not None:
-            yield mention, cit_num
+    for chunk in generate_mentions(file_path, chunksize):
+        # A formal citation needs a "[" in the text. Checking for it over the
+        # whole chunk at once leaves few rows for the per-mention checks
+        chunk = chunk[chunk["text"].str.contains("[", regex=False)]
+        columns = [chunk[column].tolist() for column in MENTION_COLUMNS]
+        for values in zip(*columns):
+            mention = dict(zip(MENTION_COLUMNS, values))
+            if mention["software"] not in mention["text"]:
+                continue
+            cit_num = extract_citation_number(mention)
+            if cit_num is not None:
+                yield mention, cit_num
 
 
-def get_source_pmc_metadata(mention):
+def group_mentions_by_article(file_path):
     """
-    Get the metadata of the source paper of a mention from PMC.
+    Group software mentions with a formal citation by the article they appear
+    in, so that each article only needs to be fetched and parsed once.
 
-    :param mention: Software mention object
-    :return: Source metadata (XML JATS)
+    :param file_path: File path of a TSV file from CZI dataset
+    :return: Map of PMC ID to a list of tuples (sequence number of the mention
+        in the input, software mention object with only the fields in
+        GROUPED_MENTION_COLUMNS, formal citation number)
+    """
+
+    articles = defaultdict(list)
+    mentions_generator = generate_mentions_with_citations(file_path)
+    for i, (mention, citation_number) in enumerate(mentions_generator):
+        mention = {column: mention[column] for column in GROUPED_MENTION_COLUMNS}
+        articles[mention["pmcid"]].append((i, mention, citation_number))
+    return articles
+
+
+def write_atomically(path, data):
+    """
+    Write a file so that concurrent readers see either nothing or the whole
+    file, never a partial write.
+
+    :param path: File path
+    :param data: Bytes to write
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def get_cache_paths(cache_dir, key):
+    """
+    Get the paths used to cache an S3 object. The cache is content-addressed:
+    object bodies are stored under the SHA-256 of their content, and a small
+    file per S3 key records the digest of the body stored for that key, or is
+    empty if the key does not exist in the bucket.
+
+    :param cache_dir: Cache directory
+    :param key: S3 key
+    :return: Tuple (path of the file for the key, function mapping a digest to
+        the path of the body with that digest)
+    """
+
+    key_digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    key_path = os.path.join(cache_dir, "keys", key_digest[:2], key_digest)
+
+    def object_path(digest):
+        return os.path.join(cache_dir, "objects", digest[:2], digest)
+
+    return key_path, object_path
+
+
+def read_cached_object(cache_dir, key):
+    """
+    Read an S3 object from the cache.
+
+    :param cache_dir: Cache directory
+    :param key: S3 key
+    :return: Tuple (whether the key was cached, object body or None if the key
+        does not exist in the bucket)
     """
 
-    pmcid = mention["pmcid"]
-    key = f"oa_comm/xml/all/PMC{pmcid}.xml"
+    key_path, object_path = get_cache_paths(cache_dir, key)
+    try:
+        with open(key_path) as f:
+            digest = f.read()
+        if not digest:
+            return True, None
+        with open(object_path(digest), "rb") as f:
+            body = f.read()
+    except FileNotFoundError:
+        # Either never fetched, or the body was evicted
+        return False, None
+    # Eviction removes the least recently used bodies first
+    os.utime(object_path(digest))
+    return True, body
+
+
+def write_cached_object(cache_dir, key, body):
+    """
+    Write an S3 object to the cache.
+
+    :param cache_dir: Cache directory
+    :param key: S3 key
+    :param body: Object body, or None if the key does not exist in the bucket
+    """
+
+    key_path, object_path = get_cache_paths(cache_dir, key)
+    digest = ""
+    if body is not None:
+        digest = hashlib.sha256(body).hexdigest()
+        if not os.path.exists(object_path(digest)):
+            write_atomically(object_path(digest), body)
+    write_atomically(key_path, digest.encode("utf-8"))
+
+
+def evict_cache(cache_dir, max_size):
+    """
+    Remove the least recently used object bodies from the cache until their
+    total size is at most max_size bytes.
+
+    :param cache_dir: Cache directory
+    :param max_size: Maximum total size of cached bodies in bytes
+    :return: Number of bodies removed
+    """
+
+    objects = []
+    for root, _, files in os.walk(os.path.join(cache_dir, "objects")):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            objects.append((stat.st_mtime, stat.st_size, path))
+    total_size = sum(size for _, size, _ in objects)
+    removed = 0
+    for _, size, path in sorted(objects):
+        if total_size <= max_size:
+            break
+        os.remove(path)
+        total_size -= size
+        removed += 1
+    return removed
+
+
+def fetch_pmc_object(key, cache_dir=None):
+    """
+    Fetch an object from the PMC bucket, reading it from the cache if possible.
+
+    :param key: S3 key
+    :param cache_dir: Cache directory, or None to always fetch from S3
+    :return: Object body, or None if the key does not exist in the bucket
+    """
+
+    if cache_dir is not None:
+        cached, body = read_cached_object(cache_dir, key)
+        if cached:
+            return body
     try:
         body = s3_client.get_object(Bucket=PMC_BUCKET, Key=key)["Body"].read()
-        return ET.fromstring(body)
     except s3_client.exceptions.NoSuchKey:
-        return None
+        body = None
+    if cache_dir is not None:
+        write_cached_object(cache_dir, key, body)
+    return body
+
+
+def init_pmc_archives(index_file):
+    """
+    Read articles from local PMC OA bulk packages instead of S3.
+
+    :param index_file: Path to an index of the packages, built by
+        pmc_archive_index.build_index
+    """
+
+    global pmc_archive_reader
+    pmc_archive_reader = ArchiveReader(index_file)
+
+
+def get_source_pmc_xml(pmcid, cache_dir=None):
+    """
+    Get the metadata of a source paper from PMC, either from S3 or, if
+    init_pmc_archives was called, from local bulk packages.
+
+    :param pmcid: PMC ID of the source paper
+    :param cache_dir: Cache directory for XML fetched from S3, or None to
+        disable caching
+    :return: Source metadata (XML JATS bytes) or None
+    """
+
+    if pmc_archive_reader is not None:
+        return pmc_archive_reader.read(pmcid)
+    return fetch_pmc_object(f"oa_comm/xml/all/PMC{pmcid}.xml", cache_dir)
 
 
-def extract_reference(citation_number, jats_metadata):
+def extract_reference_index(jats_metadata):
     """
-    Extract a bibliographic reference from the PMC metadata based on the
-    citation number.
+    Map the citation numbers of all bibliographic references in the PMC
+    metadata to the DOI and PMID of the cited paper, in a single pass. The
+    document is parsed incrementally and everything outside of the
+    reference lists is discarded as soon as it has been read.
 
-    :param citation_number: Citation number
-    :param jats_metadata: Metadata (XML JATS)
-    :return: Bibliographic reference or None (XML JATS)
+    :param jats_metadata: Metadata (XML JATS bytes) or None
+    :return: Map of citation number to a tuple (DOI or None, PMID or None)
     """
 
+    index = {}
     if jats_metadata is None:
-        return None
-    for ref_list in jats_metadata.findall(".//ref-list"):
-        for reference in ref_list:
-            if "ref" != reference.tag:
-                continue
+        return index
+    tags = []
+    in_ref_list = 0
+    events = ET.iterparse(io.BytesIO(jats_metadata), events=("start", "end"))
+    for event, element in events:
+        if event == "start":
+            tags.append(element.tag)
+            in_ref_list += element.tag == "ref-list"
+            continue
+        tags.pop()
+        if element.tag == "ref" and tags and tags[-1] == "ref-list":
             # The references in JATS have "id" attributes which are typically
             # a number with a prefix, for example "CR12". To locate the right
             # reference, we ignore the prefix and compare the number with the
             # citation number from the software mention.
-            reference_id = re.search("[1-9]\d*", reference.attrib["id"])
-            if reference_id is None:
-                continue
-            reference_id = reference_id.group()
-            if citation_number == reference_id:
-                return reference
-    return None
+            reference_id = REFERENCE_ID_REGEX.search(element.attrib.get("id", ""))
+            if reference_id is not None and reference_id.group() not in index:
+                index[reference_id.group()] = (
+                    get_pub_id(element, "doi"),
+                    get_pub_id(element, "pmid"),
+                )
+        in_ref_list -= element.tag == "ref-list"
+        if not in_ref_list or element.tag == "ref":
+            element.clear()
+    return index
+
+
+def get_reference_index_path(cache_dir, pmcid):
+    """
+    Get the path of the sidecar file holding the reference index of an
+    article.
+
+    :param cache_dir: Cache directory
+    :param pmcid: PMC ID of the article
+    :return: File path
+    """
+
+    return os.path.join(cache_dir, "references", f"PMC{pmcid}.json")
+
+
+def read_reference_index(cache_dir, pmcid):
+    """
+    Read the reference index of an article from its sidecar file. Sidecars are
+    not subject to the cache's size-based eviction, so once an article has been
+    indexed its XML is never fetched or parsed again.
+
+    :param cache_dir: Cache directory
+    :param pmcid: PMC ID of the article
+    :return: Map of citation number to a tuple (DOI or None, PMID or None), or
+        None if the article has not been indexed yet
+    """
+
+    try:
+        with open(get_reference_index_path(cache_dir, pmcid)) as f:
+            return {number: tuple(ids) for number, ids in json.load(f).items()}
+    except FileNotFoundError:
+        return None
+
+
+def write_reference_index(cache_dir, pmcid, index):
+    """
+    Write the reference index of an article to its sidecar file.
+
+    :param cache_dir: Cache directory
+    :param pmcid: PMC ID of the article
+    :param index: Map of citation number to a tuple (DOI or None, PMID or None)
+    """
+
+    path = get_reference_index_path(cache_dir, pmcid)
+    write_atomically(path, json.dumps(index, separators=(",", ":")).encode())
 
 
 def get_pub_id(reference, id_type):
@@ -123,120 +462,318 @@ def get_pub_id(reference, id_type):
     return None
 
 
-def get_reference_pub_ids(data):
+async def fetch_source_pmc_xml(pmcid, cache_dir, io_executor, retries):
     """
-    Map a software mention with a formal citation to the DOI and/or PMID of the
-    formally cited paper.
-
-    :param data: A tuple containing sequence number (for displaying script's
-        progress), software mention object, and formal citation number
-    :return: Input mention and formal citation DOI and/or PMID
+    Get the metadata of a source paper from PMC without blocking the event
+    loop, retrying with exponential backoff and jitter when S3 fails or
+    throttles us.
+
+    :param pmcid: PMC ID of the source paper
+    :param cache_dir: Cache directory for fetched XML, or None
+    :param io_executor: Thread pool the blocking S3 calls are run in
+    :param retries: Number of times to retry a failed fetch
+    :return: Source metadata (XML JATS bytes) or None
     """
 
-    i, mention, citation_number = data
-    print(f"Phase 1, mention {i}")
-
-    metadata = get_source_pmc_metadata(mention)
-    reference = extract_reference(citation_number, metadata)
-    if reference is None:
-        return mention, None, None
-    return mention, get_pub_id(reference, "doi"), get_pub_id(reference, "pmid")
-
-
-def record_ids(mention_ref_ids, mention, doi, pmid):
+    loop = asyncio.get_running_loop()
+    for attempt in range(retries + 1):
+        try:
+            return await loop.run_in_executor(
+                io_executor, get_source_pmc_xml, pmcid, cache_dir
+            )
+        except (BotoCoreError, ClientError) as e:
+            if attempt == retries:
+                raise
+            delay = RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+            print(f"Phase 1, retrying PMC{pmcid} in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+
+async def get_reference_pub_ids(
+    i, mentions, cache_dir, io_executor, parse_executor, retries
+):
     """
-    Record extracted IDs in the mention_ref_ids map.
-
-    :param mention_ref_ids: The map to update
-    :param mention: Software mention object
-    :param doi: DOI of a paper formally cited with the mention
-    :param PMID: PMID of a paper formally cited with the mention
+    Map the software mentions with a formal citation in an article to the DOI
+    and/or PMID of the formally cited papers. The article's references are
+    indexed once for all of its mentions, in a process from parse_executor so
+    that parsing doesn't hold up fetches.
+
+    :param i: Sequence number of the article (for displaying script's progress)
+    :param mentions: A list of tuples (sequence number of the mention, software
+        mention object, formal citation number) for mentions in the article
+    :param cache_dir: Cache directory for fetched XML and reference indexes,
+        or None
+    :param io_executor: Thread pool the blocking S3 and disk calls are run in
+    :param parse_executor: Process pool the XML is parsed in
+    :param retries: Number of times to retry a failed fetch
+    :return: List of tuples (sequence number of the mention, input mention,
+        formal citation DOI and/or PMID), or None if the article couldn't be
+        fetched
     """
 
-    mention_id = mention["ID"]
-    software = mention["software"]
-    if mention_id not in mention_ref_ids:
-        mention_ref_ids[mention_id] = {
-            "name": software,
-            "dois": defaultdict(lambda: 0),
-            "pmids": defaultdict(lambda: 0),
-        }
-    if doi is not None:
-        mention_ref_ids[mention_id]["dois"][doi.lower()] += 1
-    if pmid is not None:
-        mention_ref_ids[mention_id]["pmids"][pmid] += 1
+    loop = asyncio.get_running_loop()
+    pmcid = mentions[0][1]["pmcid"]
+    index = None
+    if cache_dir is not None:
+        index = await loop.run_in_executor(
+            io_executor, read_reference_index, cache_dir, pmcid
+        )
+    if index is None:
+        try:
+            body = await fetch_source_pmc_xml(pmcid, cache_dir, io_executor, retries)
+        except (BotoCoreError, ClientError) as e:
+            # Nothing is cached or journaled for the article, so a later run
+            # will try again
+            print(f"Phase 1, giving up on PMC{pmcid}: {e}")
+            return None
+        index = {}
+        if body is not None:
+            index = await loop.run_in_executor(
+                parse_executor, extract_reference_index, body
+            )
+        if cache_dir is not None:
+            await loop.run_in_executor(
+                io_executor, write_reference_index, cache_dir, pmcid, index
+            )
+    print(f"Phase 1, article {i} ({len(mentions)} mentions)")
+
+    results = []
+    for seq, mention, citation_number in mentions:
+        doi, pmid = index.get(citation_number, (None, None))
+        results.append((seq, mention, doi, pmid))
+    return results
+
+
+async def get_all_reference_pub_ids(
+    articles, cache_dir, concurrency, parse_workers, retries, journal=None
+):
+    """
+    Map the software mentions with a formal citation in all articles to the DOI
+    and/or PMID of the formally cited papers. Up to concurrency articles are
+    fetched at once, while their XML is parsed by parse_workers processes.
+    Each article's results are journaled as soon as they are known. The event
+    loop only schedules the work: fetches are blocking boto3 calls run in a
+    pool of concurrency threads, one per article in flight.
+
+    :param articles: Map of PMC ID to a list of tuples (sequence number of the
+        mention, software mention object, formal citation number)
+    :param cache_dir: Cache directory for fetched XML and reference indexes,
+        or None
+    :param concurrency: Maximum number of articles to fetch at once, which is
+        also the number of I/O threads
+    :param parse_workers: Number of processes parsing XML
+    :param retries: Number of times to retry a failed fetch
+    :param journal: Journal opened with open_journal, or None
+    :return: List of tuples (sequence number of the mention, input mention,
+        formal citation DOI and/or PMID), in no particular order
+    """
 
+    results = []
+    # Workers share one iterator over the articles, so only as many articles
+    # are in flight as there are workers
+    articles_iter = enumerate(articles.values())
+    # Parse workers are only started once the I/O threads are running, and
+    # forking a process with threads can leave locks held in the child, e.g. by
+    # boto3 or the allocator, so they are started from a forkserver instead
+    with ThreadPoolExecutor(concurrency) as io_executor, ProcessPoolExecutor(
+        parse_workers, mp_context=multiprocessing.get_context("forkserver")
+    ) as parse_executor:
+
+        async def worker():
+            for i, mentions in articles_iter:
+                article_results = await get_reference_pub_ids(
+                    i, mentions, cache_dir, io_executor, parse_executor, retries
+                )
+                if article_results is None:
+                    results.extend((seq, m, None, None) for seq, m, _ in mentions)
+                    continue
+                results.extend(article_results)
+                if journal is not None:
+                    refs = {
+                        citation_number: [doi, pmid]
+                        for (_, _, citation_number), (_, _, doi, pmid) in zip(
+                            mentions, article_results
+                        )
+                    }
+                    pmcid = mentions[0][1]["pmcid"]
+                    write_journal_entry(
+                        journal, {"phase": 1, "pmcid": pmcid, "refs": refs}
+                    )
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def open_journal(journal_file, resume):
+    """
+    Open the append-only journal of a run. Phase 1 appends the references
+    found for each article, and Phase 2 the ROR IDs found for each batch of
+    DOIs and PMIDs, so that a resumed run can skip that work.
+
+    :param journal_file: Path of the journal
+    :param resume: If true, keep the entries of an earlier run. Otherwise, the
+        journal is started afresh
+    :return: A tuple (journal opened for appending, list of entries of the
+        earlier run)
+    """
 
-def most_popular_id(dictionary, min_count=5):
+    entries = []
+    if resume and os.path.exists(journal_file):
+        valid_length = 0
+        with open(journal_file, "rb") as f:
+            for line in f:
+                # A crash can leave the last entry partly written
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                valid_length += len(line)
+        os.truncate(journal_file, valid_length)
+    return open(journal_file, "a" if resume else "w"), entries
+
+
+def write_journal_entry(journal, entry):
     """
-    Get most popular ID from a counter dictionary.
+    Append an entry to the journal, and hand it to the OS straight away, so it
+    survives the process crashing.
 
-    :param dictionary: A counter dictionary (ID->count)
-    :param min_count: Minimum count
-    :return: The most popular ID or None
+    :param journal: Journal opened with open_journal
+    :param entry: JSON-serializable entry
     """
 
-    sorted_values = sorted(dictionary.items(), key=lambda x: x[1], reverse=True)
-    if sorted_values and sorted_values[0][1] >= min_count:
-        return sorted_values[0][0]
-    return None
+    journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+    journal.flush()
 
 
-def get_openalex_metadata(pub_id_type, pub_id):
+class MentionRefCounts:
     """
-    Get metadata from OpenAlex.
-
-    :param pub_id_type: Identifier type, either doi or pmid
-    :param pub_id: Identifier
-    :return: OpenAlex metadata record
+    Counts of the DOIs and PMIDs formally cited with each software mention.
+    Mention IDs, DOIs and PMIDs are interned as integers, and every citation is
+    appended to flat arrays of (mention, DOI or PMID) pairs, so that a citation
+    takes a few bytes whatever the number of mentions, and the counts can be
+    pickled.
     """
 
-    data = requests.get(f"{OPENALEX_URL}/works/{pub_id_type}:{pub_id}")
-    return data.json() if data.status_code == 200 else None
-
+    def __init__(self):
+        self.mention_indexes = {}
+        self.mention_ids = []
+        self.names = []
+        self.pub_id_indexes = {"doi": {}, "pmid": {}}
+        self.pub_ids = {"doi": [], "pmid": []}
+        self.citations = {
+            pub_id_type: (array("I"), array("I")) for pub_id_type in self.pub_ids
+        }
 
-def extract_openalex_ror_ids(pub_id_type, pub_id):
+    def record(self, mention, doi, pmid):
+        """
+        Record the IDs extracted from a formal citation of a mention.
+
+        :param mention: Software mention object
+        :param doi: DOI of a paper formally cited with the mention
+        :param pmid: PMID of a paper formally cited with the mention
+        """
+
+        mention_index = self.mention_indexes.get(mention["ID"])
+        if mention_index is None:
+            mention_index = self.mention_indexes[mention["ID"]] = len(self.mention_ids)
+            self.mention_ids.append(mention["ID"])
+            self.names.append(mention["software"])
+        for pub_id_type, pub_id in [("doi", doi and doi.lower()), ("pmid", pmid)]:
+            if pub_id is None:
+                continue
+            indexes = self.pub_id_indexes[pub_id_type]
+            pub_id_index = indexes.get(pub_id)
+            if pub_id_index is None:
+                pub_id_index = indexes[pub_id] = len(indexes)
+                self.pub_ids[pub_id_type].append(pub_id)
+            mention_indexes, pub_id_indexes = self.citations[pub_id_type]
+            mention_indexes.append(mention_index)
+            pub_id_indexes.append(pub_id_index)
+
+    def most_popular_ids(self, pub_id_type, min_count=5):
+        """
+        Get the most popular DOI or PMID of every mention. Ties are broken in
+        favour of the ID cited first with the mention.
+
+        :param pub_id_type: "doi" or "pmid"
+        :param min_count: Minimum count
+        :return: The most popular ID or None for every mention, in the order
+            the mentions were first recorded
+        """
+
+        mention_indexes, pub_id_indexes = (
+            np.frombuffer(ids, dtype=ids.typecode)
+            for ids in self.citations[pub_id_type]
+        )
+        top_ids = [None] * len(self.mention_ids)
+        if not len(mention_indexes):
+            return top_ids
+        # Count each (mention, ID) pair in a single pass over the sorted pairs,
+        # then keep the first pair of every mention in order of decreasing count
+        # and first citation
+        pairs = mention_indexes.astype(np.int64) * len(self.pub_ids[pub_id_type])
+        pairs += pub_id_indexes
+        pairs, first_citations, counts = np.unique(
+            pairs, return_index=True, return_counts=True
+        )
+        pair_mentions = pairs // len(self.pub_ids[pub_id_type])
+        order = np.lexsort((first_citations, -counts, pair_mentions))
+        is_top = np.ones(len(order), dtype=bool)
+        is_top[1:] = pair_mentions[order[1:]] != pair_mentions[order[:-1]]
+        top = order[is_top]
+        top = top[counts[top] >= min_count]
+        pub_ids = self.pub_ids[pub_id_type]
+        for mention_index, pub_id_index in zip(
+            pair_mentions[top].tolist(),
+            (pairs[top] % len(pub_ids)).tolist(),
+        ):
+            top_ids[mention_index] = pub_ids[pub_id_index]
+        return top_ids
+
+
+def extract_openalex_ror_ids(pub_id_type, pub_ids, openalex_url, cache_file=None):
     """
-    Extract ROR IDs from OpenAlex metadata.
+    Extract ROR IDs from OpenAlex metadata. The identifiers are requested from
+    OpenAlex in batches of up to ror_lookup.OPENALEX_BATCH_SIZE.
 
     :param pub_id_type: Identifier type, either doi or pmid
-    :param pub_id: Identifier
-    :return: A set of ROR IDs
+    :param pub_ids: Identifiers
+    :param openalex_url: Base URL of the OpenAlex API
+    :param cache_file: Path to a cache of OpenAlex lookups, or None to use the
+        cache named by the OPENALEX_CACHE environment variable, if any
+    :return: A tuple (map of each identifier that could be looked up to a set
+        of ROR IDs, map of the other identifiers of the works found, as tuples
+        (identifier type, normalized identifier), to a set of ROR IDs)
     """
 
-    ids = set()
-    if pub_id is None:
-        return ids
-    metadata = get_openalex_metadata(pub_id_type, pub_id)
-    if metadata is None:
-        return ids
-    for author in metadata["authorships"]:
-        for institution in author["institutions"]:
-            ids.add(institution["ror"])
-    return ids
+    found = ror_lookup.lookup_works(
+        [f"{pub_id_type}:{pub_id}" for pub_id in pub_ids],
+        openalex_url,
+        cache_file=cache_file,
+    )
+    ror_ids = {}
+    for pub_id in pub_ids:
+        key = ror_lookup.parse_work_id(f"{pub_id_type}:{pub_id}")
+        if key in found:
+            ror_ids[pub_id] = set(found.pop(key))
+    return ror_ids, {key: set(rors) for key, rors in found.items()}
 
 
 def extract_ror_ids(data):
     """
-    Extract ROR IDs from OpenAlex metadata.
+    Extract ROR IDs from OpenAlex metadata for a batch of identifiers.
 
-    :param data: A tuple containing sequence number (for displaying script's
-        progress), and a dictionary with DOI and/or PMID extracted from the
-        formally cited paper.
-    :return: A tuple (mention object, ROR IDs extracted based on DOI,
-        ROR IDs extracted based on PMID)
+    :param data: A tuple containing sequence number of the first identifier in
+        the batch (for displaying script's progress), identifier type, either
+        doi or pmid, a list of identifiers, the base URL of the OpenAlex API,
+        and the path to a cache of OpenAlex lookups or None
+    :return: The output of extract_openalex_ror_ids for the batch
     """
 
-    i, mention_data = data
-    print(f"Phase 2, mention {i}")
-
-    doi = mention_data["doi"]
-    ror_ids_from_doi = extract_openalex_ror_ids("doi", doi)
+    i, pub_id_type, pub_ids, openalex_url, cache_file = data
+    print(f"Phase 2, {pub_id_type}s {i}-{i + len(pub_ids) - 1}")
 
-    pmid = mention_data["pmid"]
-    ror_ids_from_pmid = extract_openalex_ror_ids("pmid", pmid)
-
-    return mention_data, ror_ids_from_doi, ror_ids_from_pmid
+    return extract_openalex_ror_ids(pub_id_type, pub_ids, openalex_url, cache_file)
 
 
 if __name__ == "__main__":
@@ -249,43 +786,191 @@ if __name__ == "__main__":
     )
     parser.add_argument("--output", help="output CSV file", required=True)
     parser.add_argument("--threads", help="number of threads", type=int, default=4)
+    parser.add_argument(
+        "--concurrency",
+        help="maximum number of PMC articles fetched at once, each by its own "
+        f"thread, up to {MAX_CONCURRENCY}",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--retries",
+        help="number of times to retry a failed PMC fetch",
+        type=int,
+        default=5,
+    )
     parser.add_argument("--chunk", help="imap chunk size", type=int, default=16)
+    parser.add_argument(
+        "--cache-dir", help="directory for caching XML fetched from PMC across runs"
+    )
+    parser.add_argument(
+        "--cache-size",
+        help="maximum size of the PMC cache in bytes",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+    )
+    parser.add_argument(
+        "--s3-endpoint-url",
+        help="URL of an S3-compatible service to fetch PMC data from instead of "
+        "AWS, e.g. a local stand-in for testing",
+    )
+    parser.add_argument(
+        "--pmc-index",
+        help="index of local PMC OA bulk packages to read articles from "
+        "instead of S3, built by pmc_archive_index.py or with --pmc-archives",
+    )
+    parser.add_argument(
+        "--pmc-archives",
+        help="PMC OA bulk packages (.tar.gz) to add to --pmc-index before the run",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--openalex-url",
+        help="base URL of the OpenAlex API",
+        default=ror_lookup.OPENALEX_URL,
+    )
+    parser.add_argument(
+        "--journal",
+        help="journal of completed work, used to resume the run if it is "
+        "interrupted, defaults to the output file with .journal appended",
+    )
+    parser.add_argument(
+        "--resume",
+        help="skip work recorded in the journal by an earlier, interrupted run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--openalex-cache",
+        help="path to a cache of OpenAlex lookups shared between runs and "
+        "scripts, defaults to the OPENALEX_CACHE environment variable",
+    )
     args = parser.parse_args()
+    if not 1 <= args.concurrency <= MAX_CONCURRENCY:
+        parser.error(f"--concurrency must be between 1 and {MAX_CONCURRENCY}")
+    init_s3_client(args.s3_endpoint_url, args.concurrency)
+    if args.pmc_archives:
+        if not args.pmc_index:
+            parser.error("--pmc-archives requires --pmc-index")
+        build_index(args.pmc_archives, args.pmc_index)
+    if args.pmc_index:
+        init_pmc_archives(args.pmc_index)
+    journal_file = args.journal or f"{args.output}.journal"
+    journal, journal_entries = open_journal(journal_file, args.resume)
 
     # First, we extract DOIs and PMIDs from the formal citations associated with
-    # the software mentions. As we process the data, the resulting DOIs and PMIDs
-    # are gathered in mention_ref_ids map.
-    mention_ref_ids = {}
-    mentions_generator = generate_mentions_with_citations(args.input)
-    with Pool(args.threads) as p:
-        args_generator = map(
-            lambda r: (r[0], r[1][0], r[1][1]), enumerate(mentions_generator)
+    # the software mentions. Mentions are grouped by article, so that each
+    # article is fetched and parsed once. Fetches overlap on the event loop,
+    # while parsing is spread over args.threads processes. The resulting DOIs
+    # and PMIDs are counted in mention_ref_counts, in the order of the mentions
+    # in the input.
+    mention_ref_counts = MentionRefCounts()
+    articles = group_mentions_by_article(args.input)
+    mention_results = []
+    for entry in journal_entries:
+        if entry["phase"] == 1 and entry["pmcid"] in articles:
+            for seq, mention, citation_number in articles.pop(entry["pmcid"]):
+                doi, pmid = entry["refs"].get(citation_number, [None, None])
+                mention_results.append((seq, mention, doi, pmid))
+    if journal_entries:
+        print(f"Phase 1, resuming with {len(articles)} articles left")
+    mention_results += asyncio.run(
+        get_all_reference_pub_ids(
+            articles,
+            args.cache_dir,
+            args.concurrency,
+            args.threads,
+            args.retries,
+            journal,
         )
-        results = p.imap(get_reference_pub_ids, args_generator, args.chunk)
-        for mention, doi, pmid in results:
-            record_ids(mention_ref_ids, mention, doi, pmid)
+    )
+    mention_results.sort(key=lambda r: r[0])
+    for _, mention, doi, pmid in mention_results:
+        mention_ref_counts.record(mention, doi, pmid)
+    del articles, mention_results
+    if args.cache_dir is not None:
+        evict_cache(args.cache_dir, args.cache_size)
 
     # For every mention ID, we leave only the top DOI and the top PMID, if the
     # number of occurrences is at least args.min_count. Everything else is
     # discarded.
-    for mention_id, mention_data in mention_ref_ids.items():
-        mention_data["ID"] = mention_id
-        mention_data["doi"] = most_popular_id(
-            mention_data["dois"], min_count=args.min_count
+    mentions = [
+        {"ID": mention_id, "name": name, "doi": doi, "pmid": pmid}
+        for mention_id, name, doi, pmid in zip(
+            mention_ref_counts.mention_ids,
+            mention_ref_counts.names,
+            mention_ref_counts.most_popular_ids("doi", min_count=args.min_count),
+            mention_ref_counts.most_popular_ids("pmid", min_count=args.min_count),
         )
-        mention_data["pmid"] = most_popular_id(
-            mention_data["pmids"], min_count=args.min_count
-        )
-        del mention_data["dois"]
-        del mention_data["pmids"]
+    ]
+    del mention_ref_counts
 
     # For every chosen DOI and PMID, we extract its metadata record from
-    # OpenAlex, and extract all ROR IDs from it.
-    with open(args.output, "w") as f, Pool(args.threads) as p:
+    # OpenAlex, and extract all ROR IDs from it. Many mentions cite the same
+    # paper, so each distinct DOI and PMID is looked up once, in batches so that
+    # OpenAlex is sent many identifiers per request. DOIs are looked up first:
+    # the PMIDs of the works they find need no lookup of their own. The ROR IDs
+    # found are journaled, and identifiers already resolved by an earlier run
+    # are skipped.
+    ror_ids = {"doi": {}, "pmid": {}}
+    for entry in journal_entries:
+        if entry["phase"] == 2:
+            for pub_id_type in ror_ids:
+                ror_ids[pub_id_type].update(entry[pub_id_type])
+    num_lookups = 0
+    num_pmids_from_dois = 0
+    related_ids = {}
+    batch_size = ror_lookup.OPENALEX_BATCH_SIZE
+    with Pool(args.threads) as p:
+        for pub_id_type in ror_ids:
+            pub_ids = {m[pub_id_type] for m in mentions if m[pub_id_type] is not None}
+            pending = sorted(pub_ids - ror_ids[pub_id_type].keys())
+            if pub_id_type == "pmid":
+                entry = {"phase": 2, "doi": {}, "pmid": {}}
+                for pmid in pending:
+                    key = ror_lookup.parse_work_id(f"pmid:{pmid}")
+                    if key in related_ids:
+                        entry["pmid"][pmid] = sorted(related_ids[key])
+                if entry["pmid"]:
+                    write_journal_entry(journal, entry)
+                ror_ids["pmid"].update(entry["pmid"])
+                num_pmids_from_dois = len(entry["pmid"])
+                pending = [pmid for pmid in pending if pmid not in entry["pmid"]]
+            num_lookups += len(pending)
+            arguments = (
+                (
+                    i,
+                    pub_id_type,
+                    pending[i : i + batch_size],
+                    args.openalex_url,
+                    args.openalex_cache,
+                )
+                for i in range(0, len(pending), batch_size)
+            )
+            for batch_ror_ids, batch_related_ids in p.imap(
+                extract_ror_ids, arguments, args.chunk
+            ):
+                entry = {"phase": 2, "doi": {}, "pmid": {}}
+                entry[pub_id_type] = {
+                    pub_id: sorted(rors) for pub_id, rors in batch_ror_ids.items()
+                }
+                write_journal_entry(journal, entry)
+                ror_ids[pub_id_type].update(entry[pub_id_type])
+                related_ids.update(batch_related_ids)
+    journal.close()
+    num_mention_lookups = sum(
+        m[pub_id_type] is not None for m in mentions for pub_id_type in ror_ids
+    )
+    print(
+        f"Phase 2, looked up {num_lookups} distinct identifiers instead of "
+        f"{num_mention_lookups} per-mention DOIs and PMIDs, "
+        f"{num_pmids_from_dois} PMIDs were found through their DOI"
+    )
+
+    with open(args.output, "w") as f:
         writer = csv.writer(f)
-        arguments = enumerate(mention_ref_ids.values())
-        results = p.imap(extract_ror_ids, arguments, args.chunk)
-        for mention_data, ror_ids_from_doi, ror_ids_from_pmid in results:
+        for mention_data in mentions:
+            ror_ids_from_doi = set(ror_ids["doi"].get(mention_data["doi"], []))
+            ror_ids_from_pmid = set(ror_ids["pmid"].get(mention_data["pmid"], []))
             for ror_id in ror_ids_from_doi.union(ror_ids_from_pmid):
                 source_doi = mention_data["doi"] if ror_id in ror_ids_from_doi else ""
                 source_pmid = (
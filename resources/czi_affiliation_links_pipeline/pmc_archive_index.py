@@ -0,0 +1,163 @@
+"""
+Index the PMC OA bulk packages (e.g. oa_comm_xml.PMC000xxxxxx.baseline.<date>.tar.gz) on local disk, so the
+affiliation pipeline can read any article's JATS by its PMC ID without network access, and without extracting the
+packages. Members of uncompressed tar files are read in place. Gzipped packages can't be read from an arbitrary
+offset, so their members are recompressed one by one into a pack file per package, in a directory next to the index,
+where each can be read with a single seek. A package's pack file is replaced when the package changes and is indexed
+again, so pack files only ever hold the members of the packages currently indexed.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import tarfile
+import threading
+import zlib
+
+
+# Version of the index schema. Indexes written with a different version are rebuilt from scratch
+INDEX_VERSION = 2
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, pack TEXT);
+CREATE TABLE IF NOT EXISTS articles (pmcid TEXT PRIMARY KEY, path TEXT, offset INTEGER, length INTEGER,
+                                     compressed INTEGER);
+CREATE INDEX IF NOT EXISTS articles_path ON articles (path);
+"""
+MEMBER_NAME_REGEX = re.compile(r"PMC(\d+)\.xml$")
+GZIP_MAGIC = b"\x1f\x8b"
+# Number of archive members to index between commits
+COMMIT_INTERVAL = 10_000
+
+
+def get_pack_dir(index_file: str) -> str:
+    """
+    Get the directory holding the pack files of the recompressed members of gzipped packages
+    :param index_file: Path to index
+    :return: Path to pack directory
+    """
+    return f"{index_file}.packs"
+
+
+def get_pack_path(index_file: str, path: str, stat: os.stat_result) -> str:
+    """
+    Get the path of the pack file holding the recompressed members of a version of a gzipped package. Each version
+    gets its own pack file, so the pack file of the version currently indexed is never written to while it is read
+    :param index_file: Path to index
+    :param path: Absolute path to package
+    :param stat: Result of `os.stat` on the package
+    :return: Absolute path to pack file
+    """
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    name = f"{os.path.basename(path)}.{digest}.{stat.st_mtime_ns}.pack"
+    return os.path.abspath(os.path.join(get_pack_dir(index_file), name))
+
+
+def remove_unused_packs(conn: sqlite3.Connection, index_file: str) -> None:
+    """
+    Remove the pack files that no indexed package uses, such as those of packages that were indexed again since, or
+    whose indexing was interrupted
+    :param conn: Connection to index
+    :param index_file: Path to index
+    :return: None
+    """
+    used = {pack for pack, in conn.execute("SELECT pack FROM archives WHERE pack IS NOT NULL")}
+    pack_dir = get_pack_dir(index_file)
+    for name in os.listdir(pack_dir):
+        pack_path = os.path.abspath(os.path.join(pack_dir, name))
+        if pack_path not in used:
+            os.remove(pack_path)
+
+
+def build_index(archives: list, index_file: str) -> None:
+    """
+    Add PMC OA bulk packages to an index, skipping packages that were already indexed and haven't changed since. If
+    several packages hold the same article, the one indexed last wins, so later incremental packages override the
+    baseline. Packages that changed are indexed again, replacing their articles and pack file
+    :param archives: Paths to PMC OA bulk packages, as .tar or .tar.gz files
+    :param index_file: Path to index. Created if it does not exist yet
+    :return: None
+    """
+    conn = sqlite3.connect(index_file)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+        conn.executescript("DROP TABLE IF EXISTS archives; DROP TABLE IF EXISTS articles;")
+        conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        # Earlier versions kept the members of every gzipped package in a single pack file
+        if os.path.exists(f"{index_file}.pack"):
+            os.remove(f"{index_file}.pack")
+    conn.executescript(INDEX_SCHEMA)
+    os.makedirs(get_pack_dir(index_file), exist_ok=True)
+    for archive in archives:
+        path = os.path.abspath(archive)
+        stat = os.stat(path)
+        indexed = conn.execute("SELECT size, mtime, pack FROM archives WHERE path = ?", (path,)).fetchone()
+        if indexed is not None and indexed[:2] == (stat.st_size, stat.st_mtime):
+            continue
+        print(f"Indexing {archive}")
+        with open(path, mode="rb") as f:
+            compressed = f.read(2) == GZIP_MAGIC
+        pack_path = get_pack_path(index_file, path, stat) if compressed else None
+        # Articles only an earlier version of the package held are dropped along with their pack file
+        conn.execute("DELETE FROM articles WHERE path IN (?, ?)", (path, indexed[2] if indexed else None))
+        conn.execute("DELETE FROM archives WHERE path = ?", (path,))
+        # An interrupted run may have left part of this pack file behind, so it is written from the start
+        with open(pack_path or os.devnull, mode="wb") as pack:
+            # Gzipped packages are read as a stream, so they are decompressed only once
+            with tarfile.open(path, mode="r|*" if compressed else "r:") as tar:
+                for num_members, member in enumerate(tar):
+                    match = MEMBER_NAME_REGEX.search(member.name)
+                    if not member.isfile() or not match:
+                        continue
+                    if compressed:
+                        body = zlib.compress(tar.extractfile(member).read())
+                        row = (match.group(1), pack_path, pack.tell(), len(body), 1)
+                        pack.write(body)
+                    else:
+                        row = (match.group(1), path, member.offset_data, member.size, 0)
+                    conn.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)", row)
+                    if num_members % COMMIT_INTERVAL == 0:
+                        pack.flush()
+                        conn.commit()
+        conn.execute("INSERT INTO archives VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime, pack_path))
+        conn.commit()
+    remove_unused_packs(conn, index_file)
+    conn.close()
+
+
+class ArchiveReader:
+    """
+    Reads articles from an index built by `build_index`. A reader can be shared by threads: each thread gets its
+    own connection to the index
+    """
+
+    def __init__(self, index_file: str):
+        self.index_file = index_file
+        self.local = threading.local()
+
+    def read(self, pmcid: str) -> bytes:
+        """
+        Read an article's XML
+        :param pmcid: PMC ID of the article, without the PMC prefix
+        :return: Article XML (JATS), or None if no indexed package holds the article
+        """
+        if not hasattr(self.local, "conn"):
+            self.local.conn = sqlite3.connect(f"file:{self.index_file}?mode=ro", uri=True)
+        row = self.local.conn.execute("SELECT path, offset, length, compressed FROM articles WHERE pmcid = ?",
+                                      (pmcid,)).fetchone()
+        if row is None:
+            return None
+        path, offset, length, compressed = row
+        with open(path, mode="rb") as f:
+            f.seek(offset)
+            body = f.read(length)
+        return zlib.decompress(body) if compressed else body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("archives", nargs="+", help="PMC OA bulk packages to index")
+    parser.add_argument("--index", default="pmc_archives.db", help="Path to index")
+    args = parser.parse_args()
+
+    build_index(args.archives, args.index)
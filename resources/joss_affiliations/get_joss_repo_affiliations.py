@@ -9,11 +9,11 @@ from bs4 import BeautifulSoup
 from utils import ror_lookup
 
 
-def get_repo_metadata(joss_entry: str) -> list:
+def get_repo_metadata(joss_entry: str) -> dict:
     """
-    Given a file from JOSS, retrieve RORs for affiliations of authors of described software
+    Given a file from JOSS, retrieve metadata of described software
     :param joss_entry: path to JOSS file
-    :return: list of dicts of ROR ids and software metadata
+    :return: dict of software name, github slug and DOI of the JOSS paper, or None if the file doesn't have them
     """
     with open(joss_entry) as f:
         html_content = f.read()
@@ -22,7 +22,7 @@ def get_repo_metadata(joss_entry: str) -> list:
         paper_data = soup.find("div", class_="accepted-paper")
         header = paper_data.find("h1")
         if not header:
-            return []
+            return None
         title = header.text
         metadata = paper_data.find_all("span", class_="repo")
         doi, repo = None, None
@@ -32,14 +32,12 @@ def get_repo_metadata(joss_entry: str) -> list:
             elif "Repository:" in meta.text:
                 repo = meta.find("a")["href"]
         if repo and doi:
-            rors = ror_lookup.work_to_affiliation_rors(doi)
-            if rors:
-                return [{
-                    "software_name": title,
-                    "github_slug": repo.replace("https://github.com/", ""),
-                    "ror_id": ror,
-                } for ror in rors]
-    return []
+            return {
+                "software_name": title,
+                "github_slug": repo.replace("https://github.com/", ""),
+                "doi": doi,
+            }
+    return None
 
 
 def get_joss_repo_paper_mappings(joss_directory: str, output_file: str):
@@ -49,17 +47,27 @@ def get_joss_repo_paper_mappings(joss_directory: str, output_file: str):
     :param output_file: File where a mapping from github repo to paper title and doi should be written
     :return: None
     """
-    output_data = {}
-    with open(output_file, mode="w") as out:
-        for paper_dir in os.listdir(joss_directory):
-            if not os.path.isdir(os.path.join(joss_directory, paper_dir)):
+    repos = []
+    for paper_dir in os.listdir(joss_directory):
+        if not os.path.isdir(os.path.join(joss_directory, paper_dir)):
+            continue
+        for fi in os.listdir(os.path.join(joss_directory, paper_dir)):
+            if not fi.endswith(".html"):
                 continue
-            for fi in os.listdir(os.path.join(joss_directory, paper_dir)):
-                if not fi.endswith(".html"):
-                    continue
-                repo_meta = get_repo_metadata(os.path.join(joss_directory, paper_dir, fi))
-                for row in repo_meta:
-                    out.write(json.dumps(row)+"\n")
+            repo_meta = get_repo_metadata(os.path.join(joss_directory, paper_dir, fi))
+            if repo_meta:
+                repos.append(repo_meta)
+    # Look up the RORs for all papers at once, so OpenAlex is sent many DOIs per request
+    doi_rors = ror_lookup.works_to_affiliation_rors([repo_meta["doi"] for repo_meta in repos])
+    with open(output_file, mode="w") as out:
+        for repo_meta in repos:
+            for ror in doi_rors[repo_meta["doi"]]:
+                row = {
+                    "software_name": repo_meta["software_name"],
+                    "github_slug": repo_meta["github_slug"],
+                    "ror_id": ror,
+                }
+                out.write(json.dumps(row)+"\n")
 
 
 if __name__ == "__main__":
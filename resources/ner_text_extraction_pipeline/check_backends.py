@@ -0,0 +1,125 @@
+import argparse
+import sys
+import time
+import torch
+
+from itertools import islice
+from transformers import BertTokenizerFast
+
+from pipeline import (
+    BACKENDS,
+    generate_readmes,
+    generate_windows,
+    load_model,
+    predict_windows,
+)
+
+
+def get_word_labels(offset_mappings, token_predictions):
+    """
+    Get the label predicted for each word of each window, from the prediction
+    for the word's first token.
+
+    :param offset_mappings: Offset mappings of every window's tokens
+    :param token_predictions: NER raw predictions for every window's tokens
+    :return: Lists of label IDs, one per window
+    """
+
+    return [
+        [p for p, m in zip(predictions, mapping) if m[0] == 0 and m[1] != 0]
+        for mapping, predictions in zip(offset_mappings, token_predictions)
+    ]
+
+
+def run_backend(tokenizer, model, windows, batch_size):
+    """
+    Run a NER model over windows of tokens and time it.
+
+    :param tokenizer: NER tokenizer object
+    :param model: NER model object
+    :param windows: A list of lists of input tokens
+    :param batch_size: Number of windows to pass to the model at once
+    :return: A tuple of the labels of each window's words and the number of
+        windows processed per second
+    """
+
+    start = time.perf_counter()
+    offset_mappings, token_predictions = predict_windows(
+        tokenizer, model, windows, batch_size
+    )
+    elapsed = time.perf_counter() - start
+    return get_word_labels(offset_mappings, token_predictions), len(windows) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that NER backends predict the same labels as the "
+        "full-precision PyTorch model on held-out READMEs, and compare their speed"
+    )
+    parser.add_argument("--input", help="held-out READMEs directory", required=True)
+    parser.add_argument("--model", help="NER model directory path", required=True)
+    parser.add_argument(
+        "--backends",
+        help="backends to check against the torch backend",
+        choices=BACKENDS,
+        nargs="+",
+        default=["torch-int8", "onnx"],
+    )
+    parser.add_argument(
+        "--limit", help="number of READMEs to check on", type=int, default=500
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="number of README windows passed to the NER model at once",
+        type=int,
+        default=32,
+    )
+    parser.add_argument(
+        "--onnx-model", help="path of the exported ONNX model for the onnx backend"
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        help="number of threads the NER model uses within an operator",
+        type=int,
+    )
+    parser.add_argument(
+        "--min-agreement",
+        help="minimum fraction of windows whose word labels must all match the "
+        "torch backend's for a backend to pass",
+        type=float,
+        default=0.99,
+    )
+    args = parser.parse_args()
+
+    tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
+    windows = [
+        window
+        for readme in islice(generate_readmes(args.input), args.limit)
+        for window in generate_windows(readme["content"])
+    ]
+    if not windows:
+        parser.error(f"no README text found in {args.input}")
+    if args.intra_op_threads:
+        torch.set_num_threads(args.intra_op_threads)
+
+    reference, reference_speed = run_backend(
+        tokenizer, load_model(args.model), windows, args.batch_size
+    )
+    num_words = sum(len(window_labels) for window_labels in reference)
+    print(f"torch: {reference_speed:.1f} windows/sec")
+    passed = True
+    for backend in args.backends:
+        model = load_model(args.model, backend, args.onnx_model, args.intra_op_threads)
+        labels, speed = run_backend(tokenizer, model, windows, args.batch_size)
+        same_windows = sum(w == r for w, r in zip(labels, reference))
+        same_words = sum(
+            a == b for w, r in zip(labels, reference) for a, b in zip(w, r)
+        )
+        agreement = same_windows / len(windows)
+        print(
+            f"{backend}: {speed:.1f} windows/sec ({speed / reference_speed:.2f}x), "
+            f"{same_windows}/{len(windows)} windows and {same_words}/{num_words} "
+            f"words labelled as by torch"
+        )
+        passed &= agreement >= args.min_agreement
+    sys.exit(0 if passed else 1)
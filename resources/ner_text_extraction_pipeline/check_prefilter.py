@@ -0,0 +1,119 @@
+import argparse
+import sys
+import time
+
+from itertools import islice
+from transformers import BertTokenizerFast
+
+from pipeline import (
+    BACKENDS,
+    extract_organisation_names_batch,
+    generate_readmes,
+    get_prefilter_words,
+    load_model,
+    select_windows,
+)
+from utils.ror_matcher import RorMatcher
+
+
+def run_ner(tokenizer, model, texts, batch_size, prefilter):
+    """
+    Extract organisation names from texts and time it.
+
+    :param tokenizer: NER tokenizer object
+    :param model: NER model object
+    :param texts: Input texts
+    :param batch_size: Number of windows to pass to the model at once
+    :param prefilter: Extra words of the prefilter, or None not to prefilter
+    :return: A tuple of the sets of names found in each text and the number of
+        seconds it took
+    """
+
+    start = time.perf_counter()
+    names = extract_organisation_names_batch(
+        tokenizer, model, texts, batch_size, prefilter
+    )
+    return [set(n) for n in names], time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check how many of the organisation names found by running "
+        "NER on every README window are still found when only the windows "
+        "passing the prefilter are run, and how many windows it skips"
+    )
+    parser.add_argument("--input", help="sample READMEs directory", required=True)
+    parser.add_argument("--model", help="NER model directory path", required=True)
+    parser.add_argument(
+        "--ror-dump",
+        help="json file of the ROR bulk data dump, whose names are used as cues",
+    )
+    parser.add_argument(
+        "--limit", help="number of READMEs to check on", type=int, default=500
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="number of README windows passed to the NER model at once",
+        type=int,
+        default=32,
+    )
+    parser.add_argument(
+        "--backend",
+        help="NER inference backend, see load_model",
+        choices=BACKENDS,
+        default="torch",
+    )
+    parser.add_argument(
+        "--onnx-model", help="path of the exported ONNX model for the onnx backend"
+    )
+    parser.add_argument(
+        "--min-recall",
+        help="minimum fraction of the names found without the prefilter that "
+        "must be found with it for the check to pass",
+        type=float,
+        default=0.98,
+    )
+    parser.add_argument(
+        "--show-missed", help="number of missed names to print", type=int, default=20
+    )
+    args = parser.parse_args()
+
+    readmes = list(islice(generate_readmes(args.input), args.limit))
+    if not readmes:
+        parser.error(f"no README found in {args.input}")
+    texts = [readme["content"] for readme in readmes]
+    words = set()
+    if args.ror_dump:
+        words = get_prefilter_words(RorMatcher.from_dump(args.ror_dump).records)
+    windows, _, num_windows = select_windows(texts, words)
+    skipped = num_windows - len(windows)
+    print(
+        f"{skipped}/{num_windows} windows ({skipped / max(num_windows, 1):.1%}) "
+        f"skipped by the prefilter"
+    )
+
+    tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
+    model = load_model(args.model, args.backend, args.onnx_model)
+    reference, reference_time = run_ner(tokenizer, model, texts, args.batch_size, None)
+    names, prefiltered_time = run_ner(tokenizer, model, texts, args.batch_size, words)
+
+    num_reference = sum(len(n) for n in reference)
+    found = sum(len(n & r) for n, r in zip(names, reference))
+    missed = [
+        (readme["repo_name"], name)
+        for readme, n, r in zip(readmes, names, reference)
+        for name in sorted(r - n)
+    ]
+    recall = found / num_reference if num_reference else 1.0
+    print(
+        f"{found}/{num_reference} names ({recall:.1%}) found with the prefilter, "
+        f"in {prefiltered_time:.1f}s instead of {reference_time:.1f}s "
+        f"({reference_time / prefiltered_time:.1f}x)"
+    )
+    print(
+        f"{sum(not r for r in reference)}/{len(readmes)} READMEs have no names, "
+        f"{len({repo_name for repo_name, _ in missed})} READMEs have missed names"
+    )
+    for repo_name, name in missed[: args.show_missed]:
+        print(f"missed in {repo_name}: {name}")
+    sys.exit(0 if recall >= args.min_recall else 1)
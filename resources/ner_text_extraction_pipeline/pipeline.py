@@ -3,78 +3,254 @@ import csv
 import json
 import os
 import re
-import requests
+import string
+import sys
+import time
 import torch
 
 from multiprocessing.pool import Pool
 from transformers import BertTokenizerFast, BertForTokenClassification
 
+sys.path.append("..")
 
-MAX_NER_INPUT_LEN = 128
-ROR_URL = "https://api.ror.org/organizations"
-
+from utils.ror_matcher import RorMatcher, get_record_names, match_affiliation
 
-def load_model(model_path):
+MAX_NER_INPUT_LEN = 128
+BACKENDS = ["torch", "torch-int8", "onnx"]
+# Words and word prefixes that suggest a window mentions an organisation. With
+# the prefilter, only windows containing one of them, or one of the words taken
+# from the ROR dump by get_prefilter_words, are passed to the NER model. "center"
+# alone is left out as it is all over the HTML of READMEs, and "library" alone as
+# most READMEs are about one
+INSTITUTION_CUE_REGEX = re.compile(
+    r"\b(?:univ|institu|school|[eé]cole|escuela|scuola|hochschule|college|coleg"
+    r"|academ|akadem|laborat|labs?\b|centre|centro|zentrum|cent(?:er|re)s? (?:for|of)"
+    r"|medical cent|hospital|klinik|clinic|foundation|fondation|fundac|fondaz|stiftung"
+    r"|department|dept\b|facult|ministr|agency|council|consorti|societ|observator"
+    r"|museum|(?:national|state|public|royal|university) librar|librar(?:y|ies) of"
+    r"|corporation|corp\b|inc\b|ltd\b|llc\b|gmbh)"
+)
+PREFILTER_MIN_WORD_LEN = 4
+
+# NER tokenizer and model of the current process, set by init_ner_model
+tokenizer = None
+model = None
+ner_batch_size = 32
+# Offline ROR matcher of the current process, set by init_ror_matcher
+ror_matcher = None
+# Cache of ROR's affiliation matches, set by init_worker
+ror_cache_file = None
+# Extra words of the window prefilter, or None not to prefilter windows, set by
+# init_worker
+prefilter_words = None
+
+
+def load_model(model_path, backend="torch", onnx_path=None, intra_op_threads=None):
     """
     Load NER model.
-    Copied from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
+    Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
 
     :param model_path: Path of the model directory
+    :param backend: One of BACKENDS. "torch" runs the full-precision PyTorch
+        model, "torch-int8" the model with its linear layers dynamically
+        quantized to int8, and "onnx" the model exported to ONNX, with ONNX
+        Runtime
+    :param onnx_path: Path of the exported ONNX model, exported first if it does
+        not exist yet. Defaults to model.onnx in the model directory
+    :param intra_op_threads: Number of threads ONNX Runtime uses within an
+        operator, or None for its default
     :return: Model object
     """
 
     model = BertForTokenClassification.from_pretrained(model_path)
     model = model.cpu()
+    model.eval()
+    if backend == "torch-int8":
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif backend == "onnx":
+        onnx_path = onnx_path or os.path.join(model_path, "model.onnx")
+        if not os.path.exists(onnx_path):
+            export_onnx_model(model, onnx_path)
+        model = OnnxNerModel(onnx_path, model.num_labels, intra_op_threads)
     return model
 
 
-def preprocess_input(tokenizer, ner_input):
+def export_onnx_model(model, onnx_path):
+    """
+    Export NER model to ONNX, with the batch size and sequence length left
+    dynamic.
+
+    :param model: PyTorch NER model object
+    :param onnx_path: Path to write the ONNX model to
+    """
+
+    print(f"Exporting NER model to {onnx_path}")
+    model.config.return_dict = False
+    dummy_input = torch.ones((1, 8), dtype=torch.long)
+    dynamic_axes = {0: "batch", 1: "sequence"}
+    tmp_path = f"{onnx_path}.tmp"
+    torch.onnx.export(
+        model,
+        (dummy_input, dummy_input),
+        tmp_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": dynamic_axes,
+            "attention_mask": dynamic_axes,
+            "logits": dynamic_axes,
+        },
+        opset_version=14,
+    )
+    os.replace(tmp_path, onnx_path)
+
+
+class OnnxNerModel:
+    """
+    NER model exported to ONNX, run with ONNX Runtime. It is called like the
+    PyTorch model. The inference session is only created on first use, so
+    that processes forked from the one that loaded the model each create their
+    own.
+    """
+
+    def __init__(self, onnx_path, num_labels, intra_op_threads=None):
+        self.onnx_path = onnx_path
+        self.num_labels = num_labels
+        self.intra_op_threads = intra_op_threads
+        self.session = None
+
+    def __call__(self, input_ids, attention_mask):
+        if self.session is None:
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            if self.intra_op_threads:
+                options.intra_op_num_threads = self.intra_op_threads
+            self.session = onnxruntime.InferenceSession(
+                self.onnx_path, options, providers=["CPUExecutionProvider"]
+            )
+        (logits,) = self.session.run(
+            ["logits"],
+            {
+                "input_ids": input_ids.numpy(),
+                "attention_mask": attention_mask.numpy(),
+            },
+        )
+        return (torch.from_numpy(logits),)
+
+
+def init_ner_model(
+    model_path, batch_size=32, backend="torch", onnx_path=None, intra_op_threads=None
+):
+    """
+    Load the NER tokenizer and model used by extract_ror_ids_from_readmes in
+    the current process. Meant as a Pool initializer, so that each worker has
+    the model once, rather than it being pickled into every task. Workers
+    forked from a process that already loaded the model share its copy.
+
+    :param model_path: Path of the model directory
+    :param batch_size: Number of windows to pass to the model at once
+    :param backend: One of BACKENDS, see load_model
+    :param onnx_path: Path of the exported ONNX model, see load_model
+    :param intra_op_threads: Number of threads the model uses within an
+        operator, or None for the backend's default
+    """
+
+    global tokenizer, model, ner_batch_size
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if model is None:
+        model = load_model(model_path, backend, onnx_path, intra_op_threads)
+        tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
+    ner_batch_size = batch_size
+
+
+def generate_windows(text):
     """
-    Preprocess input for NER model.
-    Copied from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
+    Split text into overlapping windows of tokens short enough for the NER
+    model.
+
+    :param text: Input text
+    :return: A sequence of lists of input tokens
+    """
+
+    tokens = text.lower().split()
+
+    # The NER model used here was trained on affiliation strings rather than
+    # arbitrary text, and as such has a fairly low upper limit of the number
+    # of input tokens (128). At the same time, our input data (GitHub repo
+    # READMEs) will typically be much longer. To overcome this limitation,
+    # we move a sliding window over the input text to obtain multiple shorter
+    # substrings, and each of them is passed to the NER model separately. The
+    # detected organisation names are then concatenated and returned.
+    offset = 0
+    while offset < len(tokens):
+        yield tokens[offset : offset + MAX_NER_INPUT_LEN]
+
+        # We move the sliding window by slightly less than the maximum NER
+        # input length, so that the substrings passed to the NER model are
+        # slightly overlapping. If the substrings were not overlapping,
+        # we might miss those organisation names that happen to span over
+        # two consecutive substrings.
+        #
+        # Example:
+        #
+        # ... You are from University of Gallifrey, are you not? ...
+        # ------ substring #1 ------| |------ non-overlapping substring #2
+        #         |---------- overlapping substring #2 -------------------
+        offset += MAX_NER_INPUT_LEN - 8
+
+
+def preprocess_input(tokenizer, ner_inputs):
+    """
+    Preprocess inputs for NER model. Inputs are not padded, so that they can be
+    batched with inputs of similar length.
+    Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
 
     :param tokenizer: NER tokenizer object
-    :param ner_input: A list of input tokens
-    :return: Preprocessed input object
+    :param ner_inputs: A list of lists of input tokens
+    :return: Preprocessed input object, holding lists of input IDs, attention
+        masks and offset mappings
     """
 
     return tokenizer(
-        ner_input,
+        ner_inputs,
         is_split_into_words=True,
         return_offsets_mapping=True,
-        padding="max_length",
         truncation=True,
         max_length=MAX_NER_INPUT_LEN,
-        return_tensors="pt",
     )
 
 
 def ner_inference(model, preprocessed_input):
     """
-    Perform the NER inference.
-    Copied from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
+    Perform the NER inference on a batch of inputs.
+    Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
 
     :param model: NER model object
-    :param preprocessed_input: Preprocessed input object
-    :return: NER token predictions
+    :param preprocessed_input: Preprocessed input object, padded to the longest
+        input of the batch
+    :return: NER token predictions, one row per input
     """
 
     ids = preprocessed_input["input_ids"]
     mask = preprocessed_input["attention_mask"]
-    outputs = model(ids, attention_mask=mask)
+    with torch.inference_mode():
+        outputs = model(ids, attention_mask=mask)
     logits = outputs[0]
-    active_logits = logits.view(-1, model.num_labels)
-    predictions = torch.argmax(active_logits, axis=1)
+    predictions = torch.argmax(logits, axis=2)
     return predictions
 
 
-def postprocess_output(ner_input, token_predictions):
+def postprocess_output(offset_mapping, token_predictions):
     """
     Postprocess NER inference output
     Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
 
-    :param ner_input: Preprocessed input object
-    :param token_predictions: NER raw predictions
+    :param offset_mapping: Offset mapping of the input's tokens
+    :param token_predictions: NER raw predictions for the input's tokens
     :return: Token prediction labels or None if no organisation was detected
     """
 
@@ -90,74 +266,226 @@ def postprocess_output(ner_input, token_predictions):
     # O O O B-ORG O O
     # O B-ORG I-ORG I-ORG O O B-LOC O
     ids_to_labels = {0: "B-ORG", 1: "I-ORG", 2: "O", 3: "B-LOC", 4: "I-LOC"}
-    token_labels = [ids_to_labels[i] for i in token_predictions.cpu().numpy()]
+    token_labels = [ids_to_labels[i] for i in token_predictions]
     predictions = []
-    for token_label, mapping in zip(
-        token_labels, ner_input["offset_mapping"].squeeze().tolist()
-    ):
+    for token_label, mapping in zip(token_labels, offset_mapping):
         if mapping[0] == 0 and mapping[1] != 0:
             predictions.append(token_label)
 
     # If there is no B-ORG label in the sequence, it means that no organisation
-    # name was detected.
+    # name was detected.
     if "B-ORG" not in predictions:
         return None
     return predictions
 
 
-def extract_organisation_names(tokenizer, model, text):
+def predict_windows(tokenizer, model, windows, batch_size=32):
     """
-    Extract organisation names from text using a NER model.
-    Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
+    Run the NER model over windows of tokens. Windows are sorted by length and
+    run through the model in batches, each padded only to its longest window.
 
     :param tokenizer: NER tokenizer object
     :param model: NER model object
-    :param text: Input text
-    :return: List of extracted organisation names
+    :param windows: A list of lists of input tokens
+    :param batch_size: Number of windows to pass to the model at once
+    :return: A tuple of the offset mappings of every window's tokens, and the
+        NER raw predictions for them
     """
 
-    tokens = text.lower().split()
-    names = set()
+    if not windows:
+        return [], []
+    preprocessed_input = preprocess_input(tokenizer, windows)
+    offset_mappings = preprocessed_input["offset_mapping"]
+    input_ids = preprocessed_input["input_ids"]
+    attention_masks = preprocessed_input["attention_mask"]
+    by_length = sorted(range(len(windows)), key=lambda w: len(input_ids[w]))
+    predictions = [None] * len(windows)
+    for start in range(0, len(by_length), batch_size):
+        batch = by_length[start : start + batch_size]
+        padded_input = tokenizer.pad(
+            {
+                "input_ids": [input_ids[w] for w in batch],
+                "attention_mask": [attention_masks[w] for w in batch],
+            },
+            return_tensors="pt",
+        )
+        token_predictions = ner_inference(model, padded_input).tolist()
+        for w, window_predictions in zip(batch, token_predictions):
+            # Predictions for padding are dropped
+            predictions[w] = window_predictions[: len(input_ids[w])]
+    return offset_mappings, predictions
 
-    # The NER model used here was trained on affiliation strings rather than
-    # arbitrary text, and as such has a fairly low upper limit of the number
-    # of input tokens (128). At the same time, our input data (GitHub repo
-    # READMEs) will typically be much longer. To overcome this limitation,
-    # we move a sliding window over the input text to obtain multiple shorter
-    # substrings, and each of them is passed to the NER model separately. The
-    # detected organisation names are then concatenated and returned.
-    offset = 0
-    while offset < len(tokens):
-        tokens_chunk = tokens[offset : offset + MAX_NER_INPUT_LEN]
-        preprocessed_input = preprocess_input(tokenizer, tokens_chunk)
-        token_predictions = ner_inference(model, preprocessed_input)
-        predictions = postprocess_output(preprocessed_input, token_predictions)
 
+def get_prefilter_words(records):
+    """
+    Get the words of the window prefilter from ROR records: their one-word
+    names, aliases, labels and acronyms, such as "cern" or "inria", which the
+    keywords of INSTITUTION_CUE_REGEX miss.
+
+    :param records: ROR organization records
+    :return: Set of lowercase words
+    """
+
+    words = set()
+    for record in records:
+        names, acronyms = get_record_names(record)
+        for name in names + acronyms:
+            name = name.strip().lower()
+            if len(name) >= PREFILTER_MIN_WORD_LEN and len(name.split()) == 1:
+                words.add(name)
+    return words
+
+
+def is_candidate_window(window, words=frozenset()):
+    """
+    Check if a window might mention an organisation, and so should be passed to
+    the NER model, with a keyword search that is much cheaper than the model.
+
+    :param window: List of input tokens
+    :param words: Extra words marking a window as a candidate, see
+        get_prefilter_words
+    :return: True if the window contains an institutional cue
+    """
+
+    if INSTITUTION_CUE_REGEX.search(" ".join(window)):
+        return True
+    return any(token.strip(string.punctuation) in words for token in window)
+
+
+def select_windows(texts, prefilter=None):
+    """
+    Split texts into windows, keeping only the candidate windows if a prefilter
+    is given.
+
+    :param texts: Input texts
+    :param prefilter: Extra words of the prefilter, see is_candidate_window, or
+        None to keep all windows
+    :return: A tuple containing the kept windows, the index of the text of each
+        kept window, and the number of windows before filtering
+    """
+
+    windows = []
+    window_texts = []
+    num_windows = 0
+    for i, text in enumerate(texts):
+        for window in generate_windows(text):
+            num_windows += 1
+            if prefilter is None or is_candidate_window(window, prefilter):
+                windows.append(window)
+                window_texts.append(i)
+    return windows, window_texts, num_windows
+
+
+def extract_organisation_names_from_windows(
+    tokenizer, model, windows, window_texts, num_texts, batch_size=32
+):
+    """
+    Extract organisation names from the windows of many texts using a NER model.
+    Adapted from https://github.com/ror-community/affiliation-matching-experimental/tree/main/ner_tests/inference
+
+    :param tokenizer: NER tokenizer object
+    :param model: NER model object
+    :param windows: A list of lists of input tokens
+    :param window_texts: Index of the text of each window
+    :param num_texts: Number of texts
+    :param batch_size: Number of windows to pass to the model at once
+    :return: Lists of extracted organisation names, one per text
+    """
+
+    names = [set() for _ in range(num_texts)]
+    offset_mappings, token_predictions = predict_windows(
+        tokenizer, model, windows, batch_size
+    )
+    for w, window in enumerate(windows):
+        predictions = postprocess_output(offset_mappings[w], token_predictions[w])
         if predictions is not None:
             organization_name = " ".join(
-                w for p, w in zip(predictions, tokens_chunk) if p in ["B-ORG", "I-ORG"]
+                t for p, t in zip(predictions, window) if p in ["B-ORG", "I-ORG"]
             )
-            names.add(organization_name)
+            names[window_texts[w]].add(organization_name)
 
-        # We move the sliding window by slightly less than the maximum NER
-        # input length, so that the substrings passed to the NER model are
-        # slightly overlapping. If the substrings were not overlapping,
-        # we might miss those organisation names that happen to span over
-        # two consecutive substrings.
-        #
-        # Example:
-        #
-        # ... You are from University of Gallifrey, are you not? ...
-        # ------ substring #1 ------| |------ non-overlapping substring #2
-        #         |---------- overlapping substring #2 -------------------
-        offset += MAX_NER_INPUT_LEN - 8
+    return [list(n) for n in names]
+
+
+def extract_organisation_names_batch(
+    tokenizer, model, texts, batch_size=32, prefilter=None
+):
+    """
+    Extract organisation names from many texts using a NER model. The windows
+    of all texts are run through the model together.
+
+    :param tokenizer: NER tokenizer object
+    :param model: NER model object
+    :param texts: Input texts
+    :param batch_size: Number of windows to pass to the model at once
+    :param prefilter: Extra words of the prefilter, see is_candidate_window, or
+        None to pass all windows to the model
+    :return: Lists of extracted organisation names, one per text
+    """
+
+    windows, window_texts, _ = select_windows(texts, prefilter)
+    return extract_organisation_names_from_windows(
+        tokenizer, model, windows, window_texts, len(texts), batch_size
+    )
+
+
+def extract_organisation_names(tokenizer, model, text, batch_size=32):
+    """
+    Extract organisation names from text using a NER model.
+
+    :param tokenizer: NER tokenizer object
+    :param model: NER model object
+    :param text: Input text
+    :param batch_size: Number of windows to pass to the model at once
+    :return: List of extracted organisation names
+    """
+
+    return extract_organisation_names_batch(tokenizer, model, [text], batch_size)[0]
+
+
+def init_ror_matcher(bulk_ror_json):
+    """
+    Build the offline ROR matcher used by get_ror_id in the current process,
+    unless it was inherited from the process this one was forked from.
+
+    :param bulk_ror_json: Path to the json file of the ROR bulk data dump
+    """
+
+    global ror_matcher
+    if ror_matcher is None:
+        ror_matcher = RorMatcher.from_dump(bulk_ror_json)
 
-    return list(names)
+
+def init_worker(ner_args, bulk_ror_json=None, cache_file=None, prefilter=False):
+    """
+    Pool initializer, loading the NER model and, if a ROR dump is given, the
+    offline ROR matcher.
+
+    :param ner_args: Arguments of init_ner_model
+    :param bulk_ror_json: Path to the json file of the ROR bulk data dump, or
+        None to use ROR's affiliation matching service
+    :param cache_file: Path to a cache of ROR's affiliation matches, shared
+        between workers and runs, see ror_matcher.match_affiliation
+    :param prefilter: Whether to pass only the windows with institutional cues
+        to the NER model. Names of the ROR dump are used as cues if it is given.
+    """
+
+    global ror_cache_file, prefilter_words
+    ror_cache_file = cache_file
+    init_ner_model(*ner_args)
+    if bulk_ror_json is not None:
+        init_ror_matcher(bulk_ror_json)
+    if prefilter and prefilter_words is None:
+        prefilter_words = (
+            get_prefilter_words(ror_matcher.records) if ror_matcher else set()
+        )
 
 
 def get_ror_id(org_name):
     """
-    Using ROR's affiliation matching service, map organisation name to ROR ID.
+    Using ROR's affiliation matching, map organisation name to ROR ID. The
+    offline matcher is used if init_ror_matcher was called, and ROR's service
+    otherwise, through the cache of its matches if there is one.
 
     :param org_name: Organisation name
     :return: ROR ID or None
@@ -169,15 +497,12 @@ def get_ror_id(org_name):
 
     # remove characters that cause ROR API to return 500
     org_name = re.sub('[{."\\\\]', "", org_name)
+    if ror_matcher is not None:
+        return ror_matcher.get_ror_id(org_name)
 
-    matched = requests.get(ROR_URL, {"affiliation": org_name})
-    if matched.status_code != 200:
-        print(
-            f"ROR API request failed; input {org_name}, status code: "
-            + f"{matched.status_code}, content: {matched.content}"
-        )
+    matched = match_affiliation(org_name, ror_cache_file)
+    if matched is None:
         return None
-    matched = matched.json()
 
     for matched_org in matched["items"]:
         if matched_org["chosen"]:
@@ -200,23 +525,55 @@ def generate_readmes(input_dir):
                 yield json.loads(line)
 
 
-def extract_ror_ids_from_readme(data):
+def extract_ror_ids_from_readmes(data):
+    """
+    Extract ROR IDs from a group of README objects. The NER model is run over
+    the windows of all READMEs in the group together, in batches.
+
+    :param data: A tuple containing sequence number of the first README and
+        README objects. The NER model must have been loaded by init_ner_model.
+    :return: A tuple containing the number of windows of the READMEs, the
+        number of them passed to the model, and a list of tuples of repository
+        name and extracted organisation names and ROR IDs
     """
-    Extract ROR IDs from a given README object.
 
-    :param data: A tuple containing sequence number, README object, NER
-        tokenizer and model.
-    :return: A tuple containing repository name and extracted organisation
-        names and ROR IDs
+    i, readmes = data
+    print(f"Processing READMEs #{i}-{i + len(readmes) - 1}")
+
+    texts = [readme["content"] for readme in readmes]
+    windows, window_texts, num_windows = select_windows(texts, prefilter_words)
+    results = []
+    for readme, org_names in zip(
+        readmes,
+        extract_organisation_names_from_windows(
+            tokenizer, model, windows, window_texts, len(texts), ner_batch_size
+        ),
+    ):
+        ror_ids = [get_ror_id(org_name) for org_name in org_names]
+        names_ids = [(n, r) for n, r in zip(org_names, ror_ids) if r is not None]
+        results.append((readme["repo_name"], names_ids))
+    return num_windows, len(windows), results
+
+
+def generate_readme_groups(readmes, group_size):
     """
+    Group README objects, numbering each group by its first README.
 
-    i, readme, tokenizer, model = data
-    print(f"Processing README #{i} {readme['repo_name']}")
+    :param readmes: A sequence of README objects
+    :param group_size: Number of READMEs in a group
+    :return: A sequence of tuples of sequence number and list of README objects
+    """
 
-    org_names = extract_organisation_names(tokenizer, model, readme["content"])
-    ror_ids = [get_ror_id(org_name) for org_name in org_names]
-    names_ids = [(n, r) for n, r in zip(org_names, ror_ids) if r is not None]
-    return readme["repo_name"], names_ids
+    group = []
+    i = 0
+    for readme in readmes:
+        group.append(readme)
+        if len(group) == group_size:
+            yield i, group
+            i += len(group)
+            group = []
+    if group:
+        yield i, group
 
 
 if __name__ == "__main__":
@@ -224,23 +581,88 @@ if __name__ == "__main__":
     parser.add_argument("--input", help="input directory path", required=True)
     parser.add_argument("--model", help="NER model directory path", required=True)
     parser.add_argument("--threads", help="number of threads", type=int, default=4)
-    parser.add_argument("--chunk", help="imap chunk size", type=int, default=16)
+    parser.add_argument("--chunk", help="imap chunk size", type=int, default=1)
+    parser.add_argument(
+        "--batch-size",
+        help="number of README windows passed to the NER model at once",
+        type=int,
+        default=32,
+    )
+    parser.add_argument(
+        "--group-size",
+        help="number of READMEs whose windows are batched together",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--backend",
+        help="NER inference backend, see load_model",
+        choices=BACKENDS,
+        default="torch",
+    )
+    parser.add_argument(
+        "--onnx-model",
+        help="path of the exported ONNX model for the onnx backend, exported "
+        "first if it does not exist, defaults to model.onnx in the model directory",
+    )
+    parser.add_argument(
+        "--intra-op-threads",
+        help="number of threads each worker's NER model uses within an operator",
+        type=int,
+    )
+    parser.add_argument(
+        "--ror-dump",
+        help="json file of the ROR bulk data dump, to match organisation names "
+        "offline instead of with ROR's affiliation matching service",
+    )
+    parser.add_argument(
+        "--ror-cache",
+        help="path to a cache of ROR's affiliation matches shared between runs "
+        "and scripts, defaults to the ROR_MATCH_CACHE environment variable",
+    )
+    parser.add_argument(
+        "--prefilter",
+        help="pass only the README windows with institutional cues, such as "
+        "university or the names of the ROR dump, to the NER model",
+        action="store_true",
+    )
     parser.add_argument("--output", help="output CSV file", required=True)
     args = parser.parse_args()
+    ner_args = (
+        args.model,
+        args.batch_size,
+        args.backend,
+        args.onnx_model,
+        args.intra_op_threads,
+    )
 
-    model = load_model(args.model)
-    tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
+    # Loaded here as well, so that workers started by fork inherit the model
+    # and matcher instead of loading their own
+    worker_args = (ner_args, args.ror_dump, args.ror_cache, args.prefilter)
+    init_worker(*worker_args)
     readme_generator = generate_readmes(args.input)
 
+    num_windows = 0
+    num_predicted = 0
+    start = time.perf_counter()
     with open(args.output, "w") as f:
         writer = csv.writer(f)
         writer.writerow(["repo_name", "org_name", "ror_id"])
-        with Pool(args.threads) as p:
-            args_generator = map(
-                lambda r: (r[0], r[1], tokenizer, model), enumerate(readme_generator)
-            )
-            for repo_name, names_ids in p.imap(
-                extract_ror_ids_from_readme, args_generator, args.chunk
+        with Pool(args.threads, init_worker, worker_args) as p:
+            for group_windows, group_predicted, results in p.imap(
+                extract_ror_ids_from_readmes,
+                generate_readme_groups(readme_generator, args.group_size),
+                args.chunk,
             ):
-                for org_name, ror_id in names_ids:
-                    writer.writerow([repo_name, org_name, ror_id])
+                num_windows += group_windows
+                num_predicted += group_predicted
+                elapsed = time.perf_counter() - start
+                skipped = num_windows - num_predicted
+                print(
+                    f"{num_windows} windows in {elapsed:.1f}s, "
+                    f"{num_windows / elapsed:.1f} windows/sec, {skipped} "
+                    f"({skipped / max(num_windows, 1):.1%}) skipped by the prefilter"
+                )
+                for repo_name, names_ids in results:
+                    for org_name, ror_id in names_ids:
+                        writer.writerow([repo_name, org_name, ror_id])
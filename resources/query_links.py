@@ -0,0 +1,159 @@
+"""
+Build an on-disk index over the consolidated software-ROR links written by `consolidate_links.py`, and look links up by
+GitHub slug, software name or ROR id from Python, the command line, or a local HTTP endpoint
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Size of the memory map SQLite uses to read the index. Pages of a memory-mapped index are shared between all
+# processes reading it through the OS page cache
+MMAP_SIZE = 1 << 30
+LOOKUP_FIELDS = ["github_slug", "software_name", "ror_id"]
+INDEX_SCHEMA = """
+CREATE TABLE links (software_name TEXT, github_slug TEXT, ror_id TEXT, extraction_methods TEXT, quality REAL,
+                    norm_software_name TEXT, norm_github_slug TEXT);
+"""
+INDEXES = """
+CREATE INDEX links_github_slug ON links (norm_github_slug);
+CREATE INDEX links_software_name ON links (norm_software_name);
+CREATE INDEX links_ror_id ON links (ror_id);
+"""
+
+
+def normalize(field: str, value: str) -> str:
+    """
+    Normalize a lookup value so that it matches however the value was written in the consolidated links
+    :param field: One of `LOOKUP_FIELDS`
+    :param value: Value to normalize
+    :return: Normalized value
+    """
+    value = value.strip()
+    if field == "ror_id":
+        # Accept bare ROR ids, e.g. 02qenvm24, as well as ROR urls
+        return value if value.startswith("http") else f"https://ror.org/{value}"
+    if field == "github_slug":
+        value = value.replace("https://github.com/", "")
+    # Software names are merged case-insensitively in `consolidate_links.merge_rows`, and GitHub slugs are
+    # case-insensitive on GitHub
+    return value.lower()
+
+
+def build_index(links_csv: str, index_file: str) -> None:
+    """
+    Build an index over the csv output of `consolidate_links.py`
+    :param links_csv: Path to consolidated links csv
+    :param index_file: Path where the index should be written. Replaced if it already exists
+    :return: None
+    """
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    conn = sqlite3.connect(index_file)
+    conn.executescript(INDEX_SCHEMA)
+    with conn, open(links_csv) as f:
+        conn.executemany("INSERT INTO links VALUES (?, ?, ?, ?, ?, ?, ?)", (
+            (row["software_name"], row["github_slug"], row["ror_id"], row["extraction_methods"],
+             float(row["quality"]), normalize("software_name", row["software_name"]),
+             normalize("github_slug", row["github_slug"]))
+            for row in csv.DictReader(f)))
+        # Creating the indexes after loading the data is much faster than maintaining them during the load
+        conn.executescript(INDEXES)
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def open_index(index_file: str) -> sqlite3.Connection:
+    """
+    Open an index built by `build_index` for reading
+    :param index_file: Path to index
+    :return: Connection to the index
+    """
+    conn = sqlite3.connect(f"file:{index_file}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+def lookup(conn: sqlite3.Connection, field: str, value: str) -> list:
+    """
+    Look up software-ROR links
+    :param conn: Connection returned by `open_index`
+    :param field: Field to look up by, one of `LOOKUP_FIELDS`
+    :param value: Value to look up
+    :return: List of links in the format of the consolidated links csv, with quality as a float
+    """
+    column = {"github_slug": "norm_github_slug", "software_name": "norm_software_name", "ror_id": "ror_id"}[field]
+    rows = conn.execute(f"SELECT software_name, github_slug, ror_id, extraction_methods, quality FROM links "
+                        f"WHERE {column} = ?", (normalize(field, value),))
+    return [{
+        "software_name": software_name,
+        "github_slug": github_slug,
+        "ror_id": ror_id,
+        "extraction_methods": extraction_methods,
+        "quality": quality
+    } for software_name, github_slug, ror_id, extraction_methods, quality in rows]
+
+
+def serve(index_file: str, host: str, port: int) -> None:
+    """
+    Serve lookups over HTTP. For example, `GET /links?github_slug=tidyverse/ggplot2` returns a JSON list of the
+    links for that repository
+    :param index_file: Path to index
+    :param host: Host to listen on
+    :param port: Port to listen on
+    :return: None
+    """
+    # Each request-handling thread gets its own connection, all sharing the same memory-mapped index
+    local = threading.local()
+
+    class LinksHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {field: values[0] for field, values in parse_qs(url.query).items() if field in LOOKUP_FIELDS}
+            if url.path != "/links" or len(params) != 1:
+                self.send_error(400, f"Expected /links with exactly one of {', '.join(LOOKUP_FIELDS)}")
+                return
+            if not hasattr(local, "conn"):
+                local.conn = open_index(index_file)
+            field, value = params.popitem()
+            body = json.dumps(lookup(local.conn, field, value)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    print(f"Serving lookups over {index_file} at http://{host}:{port}/links")
+    ThreadingHTTPServer((host, port), LinksHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index", default=os.path.join("..", "software_to_ror.db"), help="Path to index")
+    parser.add_argument("--build", help="Build the index from this consolidated links csv, e.g. "
+                                        "../software_to_ror.csv")
+    parser.add_argument("--github_slug", help="Look up links for a GitHub repository, e.g. tidyverse/ggplot2")
+    parser.add_argument("--software_name", help="Look up links for a software name, e.g. ggplot2")
+    parser.add_argument("--ror_id", help="Look up links for a ROR id, e.g. https://ror.org/02qenvm24")
+    parser.add_argument("--serve", action="store_true", help="Serve lookups over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    if args.build:
+        build_index(args.build, args.index)
+    if args.serve:
+        serve(args.index, args.host, args.port)
+    else:
+        conn = open_index(args.index)
+        for field in LOOKUP_FIELDS:
+            if getattr(args, field):
+                for link in lookup(conn, field, getattr(args, field)):
+                    print(json.dumps(link))
@@ -2,17 +2,16 @@
 
 import argparse
 import sys
-import requests
-from urllib.parse import urlencode
 import csv
 import os
-import time
 import re
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def find_best_result(response):
-    json_data = response.json()
+from utils.ror_matcher import RorMatcher, match_affiliation
 
+
+def find_best_result(json_data):
     if json_data.get('number_of_results', 0) < 1:
         return {'proposed': '', 'ror_id': ''}
 
@@ -25,19 +24,19 @@ def find_best_result(response):
     return {'proposed': ror['organization']['name'], 'ror_id': ror['organization']['id']}
 
 
-def best_ror(org_name):
-    """Given an organization name, returns the best ROR ID for that organization"""
-    query = urlencode({"affiliation": org_name})
-    url = f"https://api.ror.org/organizations?{query}"
-
-    # print(f"query {org_name}")
+def best_ror(org_name, ror_matcher=None, cache_file=None):
+    """Given an organization name, returns the best ROR ID for that organization. Names are matched offline if a
+    RorMatcher is given, and with ROR's affiliation matching service otherwise, through the cache of its matches in
+    cache_file or the ROR_MATCH_CACHE environment variable, if set"""
+    if ror_matcher is not None:
+        return find_best_result(ror_matcher.match(org_name))
 
-    response = requests.get(url)
-    if response.status_code != 200:
-        print(f"Error: {response.status_code} {response.reason}")
+    # limit hitting their API too fast and getting blocked or throttled
+    response = match_affiliation(org_name, cache_file, min_interval=0.2)
+    if response is None:
         return None
 
-    return find_best_result(response=response)
+    return find_best_result(response)
 
 
 def empty_cell(cell_contents):
@@ -67,7 +66,7 @@ def github_slug(row):
     return github_s
 
 
-def proposed_ror_info(row, ror_cache):
+def proposed_ror_info(row, ror_cache, ror_matcher=None, cache_file=None):
     org_name = row['Parent Org Name']
     filled_ror = row['ROR and other mappings']
     org_info = {'proposed': '', 'ror_id': ''}
@@ -76,16 +75,15 @@ def proposed_ror_info(row, ror_cache):
         if org_name in ror_cache:
             org_info = ror_cache[org_name]
         else:
-            ror_info = best_ror(org_name)
+            ror_info = best_ror(org_name, ror_matcher, cache_file)
             if ror_info:
                 org_info = ror_info
             ror_cache[org_name] = org_info
-            time.sleep(0.2) # limit hitting their API too fast and getting blocked or throttled
 
     return org_info
 
 
-def full_enhance(args):
+def full_enhance(args, ror_matcher=None):
     ror_cache = {}
     out_file = os.path.join(os.path.dirname(args.input), 'scicrunch_working_file_enriched.csv')
 
@@ -108,13 +106,13 @@ def full_enhance(args):
                 if processed_rows % 100 == 0:
                     print(f"processed {processed_rows} rows")
 
-                org_info = proposed_ror_info(row, ror_cache)
+                org_info = proposed_ror_info(row, ror_cache, ror_matcher, args.ror_cache)
                 new_row = {key: row[key] for key in fixed_headers} | \
                           {'proposed_name': org_info['proposed'], 'proposed_ror_id': org_info['ror_id']}
                 dict_writer.writerow(new_row)
 
 
-def minimal_info(args):
+def minimal_info(args, ror_matcher=None):
     ror_cache = {}
 
     with open(args.input, 'r') as csv_file:
@@ -131,7 +129,7 @@ def minimal_info(args):
                 if processed_rows % 100 == 0:
                     print(f"processed {processed_rows} rows")
 
-                proposed_info = proposed_ror_info(row, ror_cache)
+                proposed_info = proposed_ror_info(row, ror_cache, ror_matcher, args.ror_cache)
                 if (not ('ror.org' in row['ROR and other mappings'])) and (not proposed_info['ror_id']):
                     continue
 
@@ -150,12 +148,17 @@ if __name__ == "__main__":
     parser.add_argument("--input", help="The path to the input file")
     parser.add_argument("--format", help="one of 'full' or 'minimal'.  Full enriches the original CSV with RORs, "
                                          "minimal creates csv output for combining with other processors")
+    parser.add_argument("--ror_dump", help="The path to the json file of the ROR bulk data dump, to match organization "
+                                           "names offline instead of with ROR's affiliation matching service")
+    parser.add_argument("--ror_cache", help="The path to a cache of ROR's affiliation matches, shared between runs "
+                                            "and scripts. Defaults to the ROR_MATCH_CACHE environment variable, if set")
     args = parser.parse_args()
 
+    ror_matcher = RorMatcher.from_dump(args.ror_dump) if args.ror_dump else None
     if args.format == 'full':
-        full_enhance(args)
+        full_enhance(args, ror_matcher)
     elif args.format == 'minimal':
-        minimal_info(args)
+        minimal_info(args, ror_matcher)
     else:
         parser.print_help()
         sys.exit(1)
@@ -0,0 +1,33 @@
+import math
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from consolidate_links import LinkRecord, cluster_near_duplicate_names
+
+
+def test_cluster_near_duplicate_names_with_missing_slug():
+    # Sources read with pandas, such as OpenAIRE, give records without a repository a NaN slug
+    records = [
+        LinkRecord("Scikit Learn", math.nan, "https://ror.org/01", ["openaire_czi"]),
+        LinkRecord("scikit-learn", "scikit-learn/scikit-learn", "https://ror.org/01", ["by_name"]),
+        LinkRecord("scikit_learn", None, "https://ror.org/01", ["joss_affiliation_links"]),
+    ]
+    merged, clusters = cluster_near_duplicate_names(records)
+    assert len(merged) == 1
+    # The record a cluster is merged into takes the slug of a record that has one, rather than keeping NaN
+    assert merged[0].software_name == "Scikit Learn"
+    assert merged[0].github_slug == "scikit-learn/scikit-learn"
+    assert merged[0].extraction_methods == ["openaire_czi", "by_name", "joss_affiliation_links"]
+    assert len(clusters) == 2
+
+
+def test_cluster_near_duplicate_names_keeps_versions_apart():
+    records = [
+        LinkRecord("Bowtie", math.nan, "https://ror.org/01", ["openaire_czi"]),
+        LinkRecord("Bowtie2", "", "https://ror.org/01", ["by_name"]),
+    ]
+    merged, clusters = cluster_near_duplicate_names(records)
+    assert len(merged) == 2
+    assert clusters == []
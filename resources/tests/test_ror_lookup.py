@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import threading
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import ror_lookup
+
+
+# Works the mock OpenAlex has, by lowercased DOI. Each has a PMID, except the last one
+WORKS = {
+    f"10.1234/work.{i}": {
+        "ids": {"doi": f"https://doi.org/10.1234/WORK.{i}"}
+        | ({"pmid": f"https://pubmed.ncbi.nlm.nih.gov/{1000 + i}"} if i < 119 else {}),
+        "authorships": [
+            {"institutions": [{"ror": f"https://ror.org/0{i % 7}"}, {"ror": None}]},
+            {"institutions": [{"ror": f"https://ror.org/1{i % 3}"}]},
+        ],
+    }
+    for i in range(120)
+}
+
+
+class MockOpenAlex(BaseHTTPRequestHandler):
+    """
+    Answers OpenAlex's /works endpoint with the works in WORKS, recording the query of each request
+    """
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.requests.append(query)
+        id_type, values = query["filter"][0].split(":", 1)
+        values = set(values.split("|"))
+        results = []
+        for doi, work in WORKS.items():
+            pmid = work["ids"].get("pmid", "").rsplit("/", 1)[-1]
+            if (doi if id_type == "doi" else pmid) in values:
+                results.append(work)
+        body = json.dumps({"results": results}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openalex_url():
+    MockOpenAlex.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockOpenAlex)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_works_are_requested_in_batches(openalex_url):
+    idents = [f"10.1234/work.{i}" for i in range(120)]
+    ror_lookup.works_to_affiliation_rors(idents, openalex_url)
+    assert [len(query["filter"][0].split(":", 1)[1].split("|")) for query in MockOpenAlex.requests] == [50, 50, 20]
+    assert all(query["select"] == [ror_lookup.OPENALEX_SELECT] for query in MockOpenAlex.requests)
+    assert ror_lookup.OPENALEX_SELECT == "ids,authorships"
+
+
+def test_results_map_back_to_input_ids(openalex_url):
+    idents = ["https://doi.org/10.1234/WORK.3", "doi:10.1234/work.4", "pmid:1005", "10.1234/missing", "pmid:1"]
+    rors = ror_lookup.works_to_affiliation_rors(idents, openalex_url)
+    assert rors == {
+        "https://doi.org/10.1234/WORK.3": ["https://ror.org/03", "https://ror.org/10"],
+        "doi:10.1234/work.4": ["https://ror.org/04", "https://ror.org/11"],
+        "pmid:1005": ["https://ror.org/05", "https://ror.org/12"],
+        "10.1234/missing": [],
+        "pmid:1": [],
+    }
+    # One request for the DOIs and one for the PMIDs
+    assert len(MockOpenAlex.requests) == 2
+
+
+def test_missing_works_are_cached(openalex_url, tmp_path):
+    cache_file = str(tmp_path / "openalex.db")
+    idents = ["10.1234/work.1", "10.1234/missing", "pmid:1"]
+    first = ror_lookup.works_to_affiliation_rors(idents, openalex_url, cache_file=cache_file)
+    assert first["10.1234/missing"] == [] and first["pmid:1"] == []
+    num_requests = len(MockOpenAlex.requests)
+    # Works OpenAlex did not have are cached too, so nothing is requested again, and the PMID of the work found by
+    # DOI is cached under it as well
+    second = ror_lookup.works_to_affiliation_rors(idents + ["pmid:1001"], openalex_url, cache_file=cache_file)
+    assert len(MockOpenAlex.requests) == num_requests
+    assert second == {**first, "pmid:1001": first["10.1234/work.1"]}
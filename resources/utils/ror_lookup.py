@@ -4,33 +4,210 @@ author affiliations in OpenAlex
 """
 
 import argparse
+import json
+import os
 import requests
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
-def work_to_affiliation_rors(ident: str) -> list:
+from utils import sqlite_cache
+
+
+OPENALEX_URL = "https://api.openalex.org"
+# Maximum number of values OpenAlex accepts in a single OR filter
+OPENALEX_BATCH_SIZE = 50
+# Only the fields needed to map a work back to the requested identifier and to its affiliations are fetched
+OPENALEX_SELECT = "ids,authorships"
+ID_PREFIXES = {
+    "doi": ["doi:", "https://doi.org/", "http://doi.org/", "http://dx.doi.org/", "https://dx.doi.org/"],
+    "pmid": ["pmid:", "https://pubmed.ncbi.nlm.nih.gov/", "http://pubmed.ncbi.nlm.nih.gov/"]
+}
+# If set, path to a cache of lookups shared by every script that uses this module, unless they pass their own
+OPENALEX_CACHE_ENV = "OPENALEX_CACHE"
+DEFAULT_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 5_000_000
+# Table of OpenAlex lookups in caches opened with `sqlite_cache`
+CACHE_TABLE = "works"
+
+
+def parse_work_id(ident: str) -> tuple:
+    """
+    Work out the type of a work identifier
+    :param ident: Identifier for a work, e.g. https://doi.org/10.7717/peerj.4375, doi:10.7717/peerj.4375, or
+           pmid:29456894
+    :return: Tuple of identifier type, one of 'doi' or 'pmid', and normalized identifier, or (None, ident) if the
+             identifier can't be looked up in a batch
+    """
+    stripped = ident.strip()
+    for id_type, prefixes in ID_PREFIXES.items():
+        prefix = next((prefix for prefix in prefixes if stripped.lower().startswith(prefix)), None)
+        if prefix is None:
+            continue
+        value = stripped[len(prefix):].strip("/")
+        # Values containing filter separators can't go in an OR filter
+        if "|" in value or "," in value:
+            return None, ident
+        # OpenAlex stores DOIs in lower case
+        return id_type, value.lower() if id_type == "doi" else value
+    if stripped.startswith("10."):
+        return parse_work_id(f"doi:{stripped}")
+    if stripped.isdigit():
+        return "pmid", stripped
+    return None, ident
+
+
+def get_affiliation_rors(work: dict) -> list:
+    """
+    Get the ROR ids of the author affiliations in an OpenAlex work record
+    :param work: OpenAlex work record
+    :return: Sorted list of distinct ROR ids
+    """
+    rors = set()
+    for author in work["authorships"]:
+        for institution in author["institutions"]:
+            ror = institution.get("ror")
+            if ror:
+                rors.add(ror)
+    return sorted(rors)
+
+
+def get_work_keys(work: dict) -> list:
+    """
+    Get the normalized identifiers of an OpenAlex work record, in the format returned by `parse_work_id`
+    :param work: OpenAlex work record, including its `ids`
+    :return: List of (identifier type, normalized identifier) tuples
+    """
+    keys = []
+    for id_type in ID_PREFIXES:
+        if work["ids"].get(id_type):
+            keys.append(parse_work_id(work["ids"][id_type]))
+    return keys
+
+
+def get_cache_key(id_type: str, value: str) -> str:
+    """
+    Get the cache key of a work identifier
+    :param id_type: Identifier type, as returned by `parse_work_id`
+    :param value: Normalized identifier, as returned by `parse_work_id`
+    :return: Cache key, e.g. doi:10.7717/peerj.4375
+    """
+    return f"{id_type or 'work'}:{value}"
+
+
+def lookup_works(idents: list, openalex_url: str = OPENALEX_URL, batch_size: int = OPENALEX_BATCH_SIZE,
+                 cache_file: str = None) -> dict:
+    """
+    Retrieve the ROR ids of the author affiliations for many works, requesting up to `batch_size` DOIs or PMIDs from
+    OpenAlex at a time
+    :param idents: Identifiers for works, in any of the formats accepted by `parse_work_id`. Other identifiers
+           OpenAlex understands, such as OpenAlex work ids, are looked up one at a time
+    :param openalex_url: Base URL of the OpenAlex API
+    :param batch_size: Maximum number of identifiers to request at once
+    :param cache_file: Path to a cache of lookups, opened with `sqlite_cache`. Works found in the cache, including works
+           OpenAlex did not have, are not requested again. Defaults to the path in the OPENALEX_CACHE environment
+           variable, if set
+    :return: Dict mapping the (identifier type, normalized identifier) of each work, as returned by `parse_work_id`,
+             to a list of ROR ids corresponding to author affiliations of that work. Works OpenAlex didn't have map
+             to empty lists, and works that couldn't be looked up are missing. Works found by one identifier are also
+             included under their other identifiers, e.g. the PMIDs of works looked up by DOI
+    """
+    cache_file = cache_file or os.environ.get(OPENALEX_CACHE_ENV)
+    parsed = {ident: parse_work_id(ident) for ident in idents}
+    cached = {}
+    if cache_file:
+        keys = sorted({get_cache_key(*key) for key in parsed.values()})
+        cached = sqlite_cache.read_cache(cache_file, CACHE_TABLE, keys, DEFAULT_CACHE_TTL)
+    found = {}
+    # Works OpenAlex answered for, whether or not it had them. Lookups that failed, e.g. because we were rate
+    # limited, aren't cached
+    resolved = set()
+    for id_type in ID_PREFIXES:
+        values = sorted({value for parsed_type, value in parsed.values()
+                         if parsed_type == id_type and get_cache_key(id_type, value) not in cached})
+        for start in range(0, len(values), batch_size):
+            resp = requests.get(f"{openalex_url}/works", params={
+                "filter": f"{id_type}:{'|'.join(values[start:start+batch_size])}",
+                "select": OPENALEX_SELECT,
+                "per-page": 200
+            })
+            if resp.status_code != 200:
+                continue
+            resolved.update((id_type, value) for value in values[start:start+batch_size])
+            for work in resp.json()["results"]:
+                rors = get_affiliation_rors(work)
+                for key in get_work_keys(work):
+                    found[key] = sorted(set(found.get(key, [])).union(rors))
+    for ident, (id_type, value) in parsed.items():
+        if id_type is None and get_cache_key(None, value) not in cached and (None, value) not in resolved:
+            resp = requests.get(f"{openalex_url}/works/{value}", params={"select": OPENALEX_SELECT})
+            if resp.status_code == 200:
+                found[(None, value)] = get_affiliation_rors(resp.json())
+            if resp.status_code in (200, 404):
+                resolved.add((None, value))
+    if cache_file:
+        # A work found by one identifier is cached under all of its identifiers, e.g. both its DOI and its PMID
+        sqlite_cache.write_cache(cache_file, CACHE_TABLE,
+                                 {get_cache_key(*key): found.get(key, []) for key in resolved.union(found)},
+                                 DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_ENTRIES)
+        found.update((key, cached[get_cache_key(*key)]) for key in parsed.values() if get_cache_key(*key) in cached)
+    found.update((key, []) for key in resolved if key not in found)
+    return found
+
+
+def works_to_affiliation_rors(idents: list, openalex_url: str = OPENALEX_URL,
+                              batch_size: int = OPENALEX_BATCH_SIZE, cache_file: str = None) -> dict:
+    """
+    Retrieve the ROR ids of the author affiliations for many works. See `lookup_works`
+    :param idents: Identifiers for works, in any of the formats accepted by `parse_work_id`
+    :param openalex_url: Base URL of the OpenAlex API
+    :param batch_size: Maximum number of identifiers to request at once
+    :param cache_file: Path to a cache of lookups. See `lookup_works`
+    :return: Dict mapping each identifier to a list of ROR ids corresponding to author affiliations of that work.
+             The list is empty if the work or its affiliations couldn't be found
+    """
+    found = lookup_works(idents, openalex_url, batch_size, cache_file)
+    return {ident: found.get(parse_work_id(ident), []) for ident in idents}
+
+
+def work_to_affiliation_rors(ident: str, openalex_url: str = OPENALEX_URL, cache_file: str = None) -> list:
     """
     Given a work identifier and the type of that identifier (one of 'doi' or 'pmid'),
     retrieves the ROR ids of the author affiliations for that work.
     :param ident: Identifier for a work
+    :param openalex_url: Base URL of the OpenAlex API
+    :param cache_file: Path to a cache of lookups. See `lookup_works`
     :return: List of ROR ids corresponding to author affiliations of that work
     """
-    resp = requests.get(f"https://api.openalex.org/works/{ident}")
-    rors = []
-    if resp.status_code == 200:
-        result = resp.json()
-        for author in result["authorships"]:
-            for institution in author["institutions"]:
-                ror = institution.get("ror")
-                if ror:
-                    rors.append(ror)
-    return list(set(rors))
+    return works_to_affiliation_rors([ident], openalex_url, cache_file=cache_file)[ident]
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("external_id", help="DOI or PMID we want ROR affiliation ids from. "
-                                            "DOIs must be full URLs, e.g. https://doi.org/10.7717/peerj.4375")
+    parser.add_argument("external_id", nargs="?",
+                        help="DOI or PMID we want ROR affiliation ids from, e.g. "
+                             "https://doi.org/10.7717/peerj.4375, 10.7717/peerj.4375 or pmid:29456894")
+    parser.add_argument("--input_file", help="File of DOIs and/or PMIDs, one per line, to look up in batches instead "
+                                             "of a single external_id")
+    parser.add_argument("--output_file", help="File where JSONL output of batch lookups should be written. "
+                                              "Printed if not set")
+    parser.add_argument("--openalex_url", default=OPENALEX_URL, help="Base URL of the OpenAlex API")
+    parser.add_argument("--openalex_cache", help=f"Path to a cache of OpenAlex lookups, shared between runs. Defaults "
+                                                 f"to the {OPENALEX_CACHE_ENV} environment variable, if set")
     args = parser.parse_args()
 
-    rors = work_to_affiliation_rors(args.external_id)
-    print(f"RORs found for {args.external_id}: {rors}")
\ No newline at end of file
+    if args.input_file:
+        with open(args.input_file) as f:
+            idents = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        results = works_to_affiliation_rors(idents, args.openalex_url, cache_file=args.openalex_cache)
+        lines = [json.dumps({"id": ident, "rors": results[ident]}) for ident in idents]
+        if args.output_file:
+            with open(args.output_file, mode="w") as f:
+                f.writelines(line + "\n" for line in lines)
+        else:
+            print("\n".join(lines))
+    elif args.external_id:
+        rors = work_to_affiliation_rors(args.external_id, args.openalex_url, args.openalex_cache)
+        print(f"RORs found for {args.external_id}: {rors}")
+    else:
+        parser.error("Either external_id or --input_file is required")
@@ -0,0 +1,317 @@
+"""
+Match organization names to ROR ids offline, using the ROR bulk data dump (https://zenodo.org/records/8436953)
+instead of one call to https://api.ror.org/organizations?affiliation= per name. Responses have the same shape as the
+API's: a dict of `number_of_results` and `items`, each item holding the matched `organization` record, its `score`,
+the `matching_type` and whether it was `chosen`. Organizations always have an `id` and a `name`, even with the v2
+schema of the dump, whose records have no top-level name. Names that are still matched with the API can be cached on
+disk, so that the same name is only requested once
+"""
+
+import argparse
+import json
+import os
+import re
+import requests
+import sys
+import time
+import unicodedata
+import numpy as np
+
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import sqlite_cache
+
+
+# Top score an organization needs to be chosen, as in ROR's own affiliation matching
+MIN_CHOSEN_SCORE = 0.9
+# Minimum score of the organizations returned
+MIN_SCORE = 0.5
+MAX_RESULTS = 10
+NGRAM_SIZE = 3
+# Trigrams found in more names than this, such as those of "university", are common. Rather than in posting lists,
+# they are recorded in a bitmap of the common trigrams of each name
+MAX_NGRAM_NAMES = 2000
+# Candidate names are the NUM_CANDIDATES names with the most rare trigrams in common with the query, or every name if
+# the query has no rare trigram. They are ranked by the Dice coefficient of their trigrams with the query's, and only
+# the NUM_SCORED best are scored with the slower edit-based similarity
+NUM_CANDIDATES = 200
+NUM_SCORED = 5
+# Number of bits set in each byte
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int32)
+ROR_URL = "https://api.ror.org/organizations"
+# If set, path to a cache of the API's matches shared by every script that uses this module, unless they pass their
+# own
+ROR_CACHE_ENV = "ROR_MATCH_CACHE"
+DEFAULT_CACHE_TTL = 30 * 24 * 60 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 1_000_000
+# Table of the API's matches in caches opened with `sqlite_cache`
+CACHE_TABLE = "matches"
+# Time of this process's last request to the API, to space requests out
+last_request = 0.0
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalize an organization name for matching: strip accents, lowercase, and replace punctuation with spaces
+    :param name: Organization name
+    :return: Normalized name
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[\W_]+", " ", name.lower()).split())
+
+
+def get_ngrams(name: str) -> set:
+    """
+    Get the character trigrams of a normalized name, padded with a space on each side so that the starts and ends of
+    words count
+    :param name: Normalized name
+    :return: Set of trigrams
+    """
+    padded = f" {name} "
+    return {padded[i:i+NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+
+
+def get_record_names(record: dict) -> tuple:
+    """
+    Get the names of a ROR record, from either the v1 or the v2 schema of the dump
+    :param record: ROR organization record
+    :return: Tuple of the list of names, aliases and labels, and the list of acronyms
+    """
+    if "names" in record:
+        names = [name["value"] for name in record["names"] if "acronym" not in name["types"]]
+        acronyms = [name["value"] for name in record["names"] if "acronym" in name["types"]]
+        return names, acronyms
+    names = [record["name"]] + record.get("aliases", []) + [label["label"] for label in record.get("labels", [])]
+    return names, record.get("acronyms", [])
+
+
+def get_display_name(record: dict) -> str:
+    """
+    Get the name ROR displays for an organization: its `name` in the v1 schema, or its `ror_display` name in the v2
+    schema
+    :param record: ROR organization record
+    :return: Display name, or None if the record has no name
+    """
+    if "name" in record:
+        return record["name"]
+    names = record.get("names", [])
+    for name in names:
+        if "ror_display" in name["types"]:
+            return name["value"]
+    return next((name["value"] for name in names if "acronym" not in name["types"]), None)
+
+
+def get_organization(record: dict) -> dict:
+    """
+    Get a ROR record in the shape of the organizations of the API's responses, which always have an `id` and a `name`
+    :param record: ROR organization record, in either the v1 or the v2 schema
+    :return: The record itself if it has a name, or a copy of it with its display name added
+    """
+    return record if "name" in record else {**record, "name": get_display_name(record)}
+
+
+def sort_words(name: str) -> str:
+    """
+    Sort the words of a normalized name, so that names are compared regardless of the order of their words
+    :param name: Normalized name
+    :return: Name with its words sorted
+    """
+    return " ".join(sorted(name.split()))
+
+
+class RorMatcher:
+    """
+    Matches organization names to active ROR records. Every name, alias and label of a record is indexed by its
+    character trigrams. A query is compared with the names sharing most trigrams with it, and with the acronyms it
+    equals
+    """
+
+    def __init__(self, records: list):
+        self.records = [record for record in records if record.get("status", "active") == "active"]
+        self.names = []
+        self.name_records = []
+        exact = defaultdict(set)
+        acronyms = defaultdict(set)
+        postings = defaultdict(list)
+        for i, record in enumerate(self.records):
+            names, record_acronyms = get_record_names(record)
+            for name in dict.fromkeys(filter(None, map(normalize_name, names))):
+                exact[name].add(i)
+                for ngram in get_ngrams(name):
+                    postings[ngram].append(len(self.names))
+                self.names.append(name)
+                self.name_records.append(i)
+            for acronym in record_acronyms:
+                acronyms[normalize_name(acronym)].add(i)
+        self.exact = dict(exact)
+        self.acronyms = dict(acronyms)
+        self.name_records = np.array(self.name_records, dtype=np.int32)
+        self.sorted_names = [sort_words(name) for name in self.names]
+        self.name_sizes = np.array([len(get_ngrams(name)) for name in self.names], dtype=np.int32)
+        common = sorted(ngram for ngram, ids in postings.items() if len(ids) > MAX_NGRAM_NAMES)
+        self.common_bits = {ngram: (column // 8, 1 << column % 8) for column, ngram in enumerate(common)}
+        self.common_bitmap = np.zeros((len(self.names), (len(common) + 7) // 8), dtype=np.uint8)
+        for ngram, (byte, bit) in self.common_bits.items():
+            self.common_bitmap[postings.pop(ngram), byte] |= bit
+        self.postings = {ngram: np.array(ids, dtype=np.int32) for ngram, ids in postings.items()}
+
+    @classmethod
+    def from_dump(cls, bulk_ror_json: str) -> "RorMatcher":
+        """
+        Build a matcher from the ROR bulk data dump
+        :param bulk_ror_json: Path to the dump's json file
+        :return: Matcher
+        """
+        with open(bulk_ror_json) as f:
+            return cls(json.load(f))
+
+    def score_substring(self, substring: str) -> dict:
+        """
+        Score the records that match part of an affiliation string
+        :param substring: Part of an affiliation string
+        :return: Dict mapping indexes of matching records to tuples of score and matching type
+        """
+        query = normalize_name(substring)
+        if not query:
+            return {}
+        scores = {}
+        for i in self.acronyms.get(query, ()):
+            scores[i] = (1.0, "ACRONYM")
+        for i in self.exact.get(query, ()):
+            scores[i] = (1.0, "EXACT")
+        query_ngrams = get_ngrams(query)
+        query_bitmap = np.zeros(self.common_bitmap.shape[1], dtype=np.uint8)
+        for ngram in query_ngrams & self.common_bits.keys():
+            byte, bit = self.common_bits[ngram]
+            query_bitmap[byte] |= bit
+        postings = [self.postings[ngram] for ngram in query_ngrams if ngram in self.postings]
+        if postings:
+            candidates, overlaps = np.unique(np.concatenate(postings), return_counts=True)
+            if len(candidates) > NUM_CANDIDATES:
+                top = np.argpartition(-overlaps, NUM_CANDIDATES)[:NUM_CANDIDATES]
+                candidates, overlaps = candidates[top], overlaps[top]
+        elif query_bitmap.any():
+            candidates, overlaps = np.arange(len(self.names)), 0
+        else:
+            return scores
+        overlaps = overlaps + POPCOUNT[self.common_bitmap[candidates] & query_bitmap].sum(axis=1)
+        dice = 2 * overlaps / (len(query_ngrams) + self.name_sizes[candidates])
+        if len(candidates) > NUM_SCORED:
+            candidates = candidates[np.argpartition(-dice, NUM_SCORED)[:NUM_SCORED]]
+        # Names are compared by their edit-based similarity with the query, ignoring the order of words
+        matcher = SequenceMatcher(None, b=sort_words(query))
+        for name_id in candidates.tolist():
+            i = int(self.name_records[name_id])
+            matcher.set_seq1(self.sorted_names[name_id])
+            score = round(matcher.ratio(), 2)
+            if score >= MIN_SCORE and score > scores.get(i, (0, None))[0]:
+                scores[i] = (score, "FUZZY")
+        return scores
+
+    def match(self, affiliation: str) -> dict:
+        """
+        Match an affiliation string to ROR records. The whole string and each of its comma-separated parts are
+        matched, and each organization keeps its best scoring part
+        :param affiliation: Affiliation string, e.g. an organization name
+        :return: Dict in the shape of the response of https://api.ror.org/organizations?affiliation=
+        """
+        substrings = [affiliation] + [part.strip() for part in affiliation.split(",") if part.strip()]
+        best = {}
+        for substring in dict.fromkeys(substrings):
+            for i, (score, matching_type) in self.score_substring(substring).items():
+                if i not in best or score > best[i][0]:
+                    best[i] = (score, matching_type, substring)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[1][1] == "ACRONYM", item[0]))[:MAX_RESULTS]
+        items = [{"substring": substring, "score": score, "matching_type": matching_type, "chosen": False,
+                  "organization": get_organization(self.records[i])}
+                 for i, (score, matching_type, substring) in ranked]
+        # Acronyms are too ambiguous to be chosen, and so are ties between organizations
+        if items and items[0]["score"] >= MIN_CHOSEN_SCORE and items[0]["matching_type"] != "ACRONYM" and \
+                (len(items) == 1 or items[1]["score"] < items[0]["score"]):
+            items[0]["chosen"] = True
+        return {"number_of_results": len(items), "items": items}
+
+    def get_ror_id(self, affiliation: str) -> str:
+        """
+        Get the ROR id of the organization chosen for an affiliation string
+        :param affiliation: Affiliation string, e.g. an organization name
+        :return: ROR id, or None if no organization was chosen
+        """
+        for item in self.match(affiliation)["items"]:
+            if item["chosen"]:
+                return item["organization"]["id"]
+        return None
+
+
+def trim_response(response: dict) -> dict:
+    """
+    Keep only the fields of an API response that are worth caching: the id and name of each matched organization,
+    rather than its full record
+    :param response: Response of the API
+    :return: Trimmed response, in the same shape
+    """
+    items = [{"substring": item.get("substring"), "score": item.get("score"),
+              "matching_type": item.get("matching_type"), "chosen": item.get("chosen", False),
+              "organization": {"id": item["organization"]["id"], "name": get_display_name(item["organization"])}}
+             for item in response.get("items", [])]
+    return {"number_of_results": response.get("number_of_results", len(items)), "items": items}
+
+
+def match_affiliation(affiliation: str, cache_file: str = None, ror_url: str = ROR_URL,
+                      min_interval: float = 0) -> dict:
+    """
+    Match an affiliation string to ROR records with ROR's affiliation matching service. Names that normalize to the
+    same string share a match, and matches are cached, whether or not they found an organization
+    :param affiliation: Affiliation string, e.g. an organization name
+    :param cache_file: Path to a cache of matches, opened with `sqlite_cache`. Defaults to the path in the
+           ROR_MATCH_CACHE environment variable, if set
+    :param ror_url: URL of the API's organizations endpoint
+    :param min_interval: Minimum time in seconds between this process's requests to the API, so as not to be
+           throttled
+    :return: Response of the API, keeping only the id and name of each organization, or None if the request failed
+    """
+    global last_request
+    cache_file = cache_file or os.environ.get(ROR_CACHE_ENV)
+    key = normalize_name(affiliation)
+    if cache_file:
+        cached = sqlite_cache.read_cache(cache_file, CACHE_TABLE, [key], DEFAULT_CACHE_TTL)
+        if key in cached:
+            return cached[key]
+    time.sleep(max(0.0, last_request + min_interval - time.time()))
+    last_request = time.time()
+    resp = requests.get(ror_url, {"affiliation": affiliation})
+    if resp.status_code != 200:
+        print(f"ROR API request failed; input {affiliation}, status code: {resp.status_code}, content: {resp.content}")
+        return None
+    response = trim_response(resp.json())
+    if cache_file:
+        sqlite_cache.write_cache(cache_file, CACHE_TABLE, {key: response}, DEFAULT_CACHE_TTL, DEFAULT_CACHE_MAX_ENTRIES)
+    return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bulk_ror_json", help="Path to the json file of the ROR bulk data dump")
+    parser.add_argument("affiliations", nargs="*", help="Affiliation strings to match")
+    parser.add_argument("--input_file", help="File of affiliation strings, one per line, to match instead")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    matcher = RorMatcher.from_dump(args.bulk_ror_json)
+    print(f"Indexed {len(matcher.names)} names of {len(matcher.records)} organizations in "
+          f"{time.perf_counter() - start:.1f}s")
+    affiliations = args.affiliations
+    if args.input_file:
+        with open(args.input_file) as f:
+            affiliations = [line.strip() for line in f if line.strip()]
+    start = time.perf_counter()
+    for affiliation in affiliations:
+        print(json.dumps({"affiliation": affiliation, "ror_id": matcher.get_ror_id(affiliation)}))
+    if affiliations:
+        elapsed = time.perf_counter() - start
+        print(f"Matched {len(affiliations)} affiliations in {elapsed:.2f}s, "
+              f"{len(affiliations) / elapsed:.0f} per second")
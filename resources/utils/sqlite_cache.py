@@ -0,0 +1,112 @@
+"""
+Cache of API lookups on disk, shared between scripts and runs. Each cache is an SQLite file holding one table per kind
+of lookup, mapping keys to json values. Values expire after a time to live, and once a table holds more than a
+maximum number of values the least recently used ones are removed. A cache can be used by several processes at once:
+it is written in SQLite's WAL mode, and writers wait for each other rather than failing
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+
+# Keys are looked up in chunks to stay under SQLite's limit on the number of parameters in a query
+CACHE_CHUNK_SIZE = 500
+# Expired and least recently used values are removed by each process on its first write to a table, then once every
+# CACHE_EVICT_INTERVAL values it writes, rather than on every write
+CACHE_EVICT_INTERVAL = 10_000
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT, fetched REAL, used REAL);
+CREATE INDEX IF NOT EXISTS {table}_used ON {table} (used);
+CREATE INDEX IF NOT EXISTS {table}_fetched ON {table} (fetched);
+"""
+# Connections to caches opened by this process, by (process id, path). Connections can't be shared with forked
+# processes, so they are only reused by the process that opened them
+cache_connections = {}
+# Number of values this process wrote to each table since it last removed expired and least recently used ones, by
+# (process id, path, table). Tables are created on first use, when they are added to it
+cache_writes = {}
+
+
+def get_cache_connection(cache_file: str, table: str) -> sqlite3.Connection:
+    """
+    Get this process's connection to a cache, opening the cache and creating it and the table if needed
+    :param cache_file: Path to cache
+    :param table: Name of the table of the kind of lookup
+    :return: Connection to the cache
+    """
+    key = (os.getpid(), cache_file)
+    if key not in cache_connections:
+        conn = sqlite3.connect(cache_file, timeout=60)
+        conn.execute("PRAGMA journal_mode = WAL")
+        cache_connections[key] = conn
+    conn = cache_connections[key]
+    if key + (table,) not in cache_writes:
+        conn.executescript(CACHE_SCHEMA.format(table=table))
+        cache_writes[key + (table,)] = None
+    return conn
+
+
+def read_cache(cache_file: str, table: str, keys: list, ttl: float) -> dict:
+    """
+    Read cached values, and mark them as recently used
+    :param cache_file: Path to cache
+    :param table: Name of the table of the kind of lookup
+    :param keys: Keys to look up
+    :param ttl: Maximum age in seconds of values to return. Older values are treated as missing
+    :return: Dict mapping each key found in the cache to its value
+    """
+    conn = get_cache_connection(cache_file, table)
+    now = time.time()
+    cached = {}
+    with conn:
+        for start in range(0, len(keys), CACHE_CHUNK_SIZE):
+            chunk = keys[start:start+CACHE_CHUNK_SIZE]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, value FROM {table} WHERE key IN ({placeholders}) AND fetched >= ?",
+                                chunk + [now - ttl]).fetchall()
+            cached.update((key, json.loads(value)) for key, value in rows)
+            conn.executemany(f"UPDATE {table} SET used = ? WHERE key = ?", ((now, key) for key, _ in rows))
+    return cached
+
+
+def write_cache(cache_file: str, table: str, values: dict, ttl: float, max_entries: int) -> None:
+    """
+    Write values to the cache, and every CACHE_EVICT_INTERVAL values this process writes, remove expired and least
+    recently used values with `evict_cache`
+    :param cache_file: Path to cache
+    :param table: Name of the table of the kind of lookup
+    :param values: Dict mapping keys to values that can be serialized to json
+    :param ttl: Maximum age in seconds of values to keep
+    :param max_entries: Maximum number of values to keep
+    :return: None
+    """
+    conn = get_cache_connection(cache_file, table)
+    now = time.time()
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)",
+                         ((key, json.dumps(value), now, now) for key, value in values.items()))
+    writes_key = (os.getpid(), cache_file, table)
+    if cache_writes[writes_key] is None or cache_writes[writes_key] + len(values) >= CACHE_EVICT_INTERVAL:
+        evict_cache(conn, table, ttl, max_entries)
+        cache_writes[writes_key] = 0
+    else:
+        cache_writes[writes_key] += len(values)
+
+
+def evict_cache(conn: sqlite3.Connection, table: str, ttl: float, max_entries: int) -> None:
+    """
+    Remove expired values from a table and, if it holds more than `max_entries` values, the least recently used ones
+    :param conn: Connection returned by `get_cache_connection`
+    :param table: Name of the table of the kind of lookup
+    :param ttl: Maximum age in seconds of values to keep
+    :param max_entries: Maximum number of values to keep
+    :return: None
+    """
+    with conn:
+        conn.execute(f"DELETE FROM {table} WHERE fetched < ?", (time.time() - ttl,))
+        excess = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - max_entries
+        if excess > 0:
+            conn.execute(f"DELETE FROM {table} WHERE key IN (SELECT key FROM {table} ORDER BY used LIMIT ?)",
+                         (excess,))